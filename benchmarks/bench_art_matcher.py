@@ -0,0 +1,41 @@
+# Runs the matcher over the labeled fixtures in tests/fixtures/album_matches.json
+# Reports how many lookups pick the expected album (or correctly pick none), and the CPU time each lookup costs
+#
+# Run from the repo root: python -m benchmarks.bench_art_matcher [--rounds 200] [--fixtures path]
+
+import argparse, json, os, time
+
+from threads.art_matcher import best_match
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests", "fixtures", "album_matches.json")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--fixtures", default=FIXTURES)
+    args = parser.parse_args()
+
+    with open(args.fixtures, encoding="utf-8") as fixtureFile:
+        cases = json.load(fixtureFile)
+
+    misses = []
+    for case in cases:
+        match = best_match(case["candidates"], case["track"])
+        if (match and match["id"]) != case["expected"]:
+            misses.append((case["note"], match and match["id"], case["expected"]))
+
+    start = time.process_time()
+    for _ in range(args.rounds):
+        for case in cases:
+            best_match(case["candidates"], case["track"])
+    elapsed = time.process_time() - start
+    lookups = args.rounds * len(cases)
+    candidates = args.rounds * sum(len(case["candidates"]) for case in cases)
+
+    print(f"hit rate: {len(cases) - len(misses)}/{len(cases)} ({(len(cases) - len(misses)) / len(cases):.1%})")
+    print(f"cpu per lookup: {elapsed / lookups * 1e6:.1f} us, per candidate: {elapsed / max(candidates, 1) * 1e6:.1f} us")
+    for note, got, expected in misses:
+        print(f"  miss: {note}, got {got}, expected {expected}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# Benchmarks get_all_connected against a mock bus with N remembered devices, one of them connected
+# Compares the old version (GetManagedObjects, then a proxy and four Properties.Get per device) with the current one
+# Every mock bus call counts as a round trip and sleeps for --latency seconds, like a blocking call to BlueZ would
+#
+# Run from the repo root: python -m benchmarks.bench_get_all_connected [--latency 0.001] [--devices 1 10 30 100]
+# Needs dbus-python and PyGObject importable, like the app itself
+
+import argparse, threading, time
+from types import SimpleNamespace
+
+from threads.bluetooth_control import BluetoothControlThread, DEVICE_INTERFACE
+from threads.bluez_objects import BluezObjectCache
+
+# Stands in for the system bus, counts round trips
+class MockBus:
+    def __init__(self, objects, latency):
+        self.objects = objects
+        self.latency = latency
+        self.roundTrips = 0
+
+    def round_trip(self):
+        self.roundTrips += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get_managed_objects(self):
+        self.round_trip()
+        return self.objects
+
+    # get_object introspects the remote object, that's a round trip too
+    def get_object(self, path):
+        self.round_trip()
+        return path
+
+    def get(self, path, interface, prop):
+        self.round_trip()
+        return self.objects[path][interface][prop]
+
+    def get_all(self, path, interface):
+        self.round_trip()
+        return dict(self.objects[path][interface])
+
+    # What the proxy pool hands out, GetAll is the only call get_all_connected makes on it
+    def interface(self, busName, path, interface):
+        return SimpleNamespace(GetAll=lambda iface: self.get_all(path, iface))
+
+def make_objects(devices, connected=1):
+    objects = {"/org/bluez/hci0": {"org.bluez.Adapter1": {"Address": "00:00:00:00:00:00"}}}
+    for i in range(devices):
+        address = ":".join(f"{(i >> shift) & 0xff:02X}" for shift in (40, 32, 24, 16, 8, 0))
+        objects[f"/org/bluez/hci0/dev_{address.replace(':', '_')}"] = {
+            DEVICE_INTERFACE: {"Name": f"Phone {i}", "Address": address, "Paired": True, "Connected": i < connected}
+        }
+    return objects
+
+# get_all_connected as it was before the object mirror
+def baseline_get_all_connected(bus):
+    results = []
+    for path, interfaces in bus.get_managed_objects().items():
+        if DEVICE_INTERFACE not in interfaces:
+            continue
+        bus.get_object(path)
+        results.append({
+            "obj": path,
+            "name": str(bus.get(path, DEVICE_INTERFACE, "Name")),
+            "addr": str(bus.get(path, DEVICE_INTERFACE, "Address")),
+            "paired": bool(bus.get(path, DEVICE_INTERFACE, "Paired")),
+            "connected": bool(bus.get(path, DEVICE_INTERFACE, "Connected"))
+        })
+    return [result for result in results if result["connected"]]
+
+def make_mirror(objects):
+    mirror = BluezObjectCache.__new__(BluezObjectCache)
+    mirror.objects = {path: {iface: dict(props) for iface, props in interfaces.items()} for path, interfaces in objects.items()}
+    mirror.lock = threading.RLock()
+    return mirror
+
+def measure(func, bus, repeat):
+    bus.roundTrips = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    elapsed = (time.perf_counter() - start) / repeat
+    return result, bus.roundTrips // repeat, elapsed
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.001, help="Seconds each bus round trip takes")
+    parser.add_argument("--devices", type=int, nargs="+", default=[1, 10, 30, 100])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'devices':>8} {'old trips':>10} {'old ms':>9} {'new trips':>10} {'new ms':>9} {'refresh trips':>14} {'refresh ms':>11}")
+    for devices in args.devices:
+        objects = make_objects(devices)
+        bus = MockBus(objects, args.latency)
+        thread = SimpleNamespace(bluezObjects=make_mirror(objects), get_interface=bus.interface)
+
+        old, oldTrips, oldTime = measure(lambda: baseline_get_all_connected(bus), bus, args.repeat)
+        new, newTrips, newTime = measure(lambda: BluetoothControlThread.get_all_connected(thread), bus, args.repeat)
+        fresh, refreshTrips, refreshTime = measure(lambda: BluetoothControlThread.get_all_connected(thread, refresh=True), bus, args.repeat)
+
+        # All three have to agree on what's connected
+        assert [d["addr"] for d in old] == [d["addr"] for d in new] == [d["addr"] for d in fresh]
+
+        print(f"{devices:>8} {oldTrips:>10} {oldTime * 1000:>9.2f} {newTrips:>10} {newTime * 1000:>9.2f} {refreshTrips:>14} {refreshTime * 1000:>11.2f}")
+
+if __name__ == "__main__":
+    main()
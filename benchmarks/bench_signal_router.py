@@ -0,0 +1,154 @@
+# Replays a storm of BlueZ PropertiesChanged signals against three ways of subscribing to them
+#   per receiver: every handler adds its own bus match and checks the interface itself, like before the router
+#   catch-all:    one router, but the object mirror wants every interface, so a single match without arg0 is used
+#   per interface: one router, the mirror subscribes to the interfaces it follows, so every match has an arg0
+# The fake bus filters on arg0 the way the daemon does, and copies the arguments on every delivery like unmarshalling would
+#
+# Run from the repo root: python -m benchmarks.bench_signal_router [--signals 100000] [--seed 1]
+# Only needs the standard library
+
+import argparse, logging, random, time
+
+from threads.signal_router import SignalRouter
+
+PROPERTIES_CHANGED = {"bus_name": "org.bluez", "signal_name": "PropertiesChanged", "dbus_interface": "org.freedesktop.DBus.Properties"}
+DEVICE = "/org/bluez/hci0/dev_AA_BB_CC_DD_EE_FF"
+
+# Same as MIRRORED_INTERFACES in threads/bluez_objects.py, copied so this runs without dbus-python
+MIRRORED_INTERFACES = [
+    "org.bluez.Adapter1",
+    "org.bluez.Device1",
+    "org.bluez.MediaPlayer1",
+    "org.bluez.MediaTransport1",
+    "org.bluez.MediaFolder1"
+]
+
+# (weight, path, interface, changed) for a phone playing music next to a BLE sensor and a scan in progress
+STORM = [
+    (40, "/org/bluez/hci0/dev_11_22_33_44_55_66/service0010/char0011", "org.bluez.GattCharacteristic1", {"Value": [0x01, 0x02, 0x03, 0x04]}),
+    (20, "/org/bluez/hci0/dev_22_33_44_55_66_77", "org.bluez.Device1", {"RSSI": -67, "ManufacturerData": {76: [0x10, 0x05]}}),
+    (15, DEVICE + "/player0", "org.bluez.MediaPlayer1", {"Position": 123456}),
+    (5, DEVICE + "/fd0", "org.bluez.MediaTransport1", {"Volume": 64}),
+    (5, DEVICE, "org.bluez.Battery1", {"Percentage": 80}),
+    (5, DEVICE, "org.bluez.Device1", {"RSSI": -40}),
+    (5, "/org/bluez/hci0/dev_33_44_55_66_77_88", "org.bluez.Network1", {"Connected": False}),
+    (3, DEVICE + "/player0/NowPlaying", "org.bluez.MediaFolder1", {"NumberOfItems": 12}),
+    (2, "/org/bluez/hci0", "org.bluez.Adapter1", {"Discovering": True})
+]
+
+class FakeBus:
+    def __init__(self):
+        self.rules = []
+        self.deliveries = 0
+
+    def add_signal_receiver(self, handler, path_keyword=None, **match):
+        rule = (handler, match.get("arg0"))
+        self.rules.append(rule)
+
+        bus = self
+        class Match:
+            def remove(self):
+                bus.rules.remove(rule)
+        return Match()
+
+    def emit(self, path, interface, changed, invalidated):
+        for handler, arg0 in self.rules:
+            if arg0 is not None and arg0 != interface:
+                continue
+            # Every match rule that fits is a separate message to unmarshal
+            self.deliveries += 1
+            handler(str(interface), dict(changed), list(invalidated), path=str(path))
+
+class FakeRuntime:
+    def __init__(self, bus):
+        self.bus = bus
+        self.logger = logging.getLogger("bench_signal_router")
+
+    def timed(self, handler, name=None):
+        return handler
+
+# Stand-ins for the handlers the app registers, they do about as little work as the real ones
+class Handlers:
+    def __init__(self):
+        self.objects = {}
+        self.calls = 0
+
+    def mirror(self, interface, changed, invalidated, path):
+        self.calls += 1
+        self.objects.setdefault(path, {}).setdefault(interface, {}).update(changed)
+
+    def volume(self, interface, changed, invalidated, path):
+        self.calls += 1
+
+    def playback(self, interface, changed, invalidated, path):
+        self.calls += 1
+
+    def connection(self, interface, changed, invalidated, path):
+        self.calls += 1
+
+    # (handler, arg0, path namespace) as each component subscribes
+    def subscriptions(self, mirrorInterfaces):
+        return [(self.mirror, interface, None) for interface in mirrorInterfaces] + [
+            (self.volume, "org.bluez.MediaTransport1", None),
+            (self.playback, "org.bluez.MediaPlayer1", DEVICE),
+            (self.connection, "org.bluez.Device1", None)
+        ]
+
+# Each handler on its own match, filtering in Python like the handlers used to
+def setup_per_receiver(bus, handlers):
+    def filtered(handler, arg0, pathNamespace):
+        def receiver(interface, changed, invalidated, path=None):
+            if arg0 is not None and interface != arg0:
+                return
+            if pathNamespace and path != pathNamespace and not path.startswith(pathNamespace + "/"):
+                return
+            handler(interface, changed, invalidated, path)
+        return receiver
+
+    for handler, arg0, pathNamespace in handlers.subscriptions([None]):
+        bus.add_signal_receiver(filtered(handler, arg0, pathNamespace), path_keyword="path", **PROPERTIES_CHANGED)
+
+def setup_router(mirrorInterfaces):
+    def setup(bus, handlers):
+        router = SignalRouter(FakeRuntime(bus), **PROPERTIES_CHANGED)
+        for handler, arg0, pathNamespace in handlers.subscriptions(mirrorInterfaces):
+            router.subscribe(handler, arg0=arg0, pathNamespace=pathNamespace)
+    return setup
+
+def make_storm(count, seed):
+    rng = random.Random(seed)
+    weights = [entry[0] for entry in STORM]
+    return [entry[1:] for entry in rng.choices(STORM, weights=weights, k=count)]
+
+def run(setup, storm):
+    bus, handlers = FakeBus(), Handlers()
+    setup(bus, handlers)
+
+    start = time.perf_counter()
+    for path, interface, changed in storm:
+        bus.emit(path, interface, changed, [])
+    elapsed = time.perf_counter() - start
+
+    return len(bus.rules), bus.deliveries, handlers.calls, elapsed
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--signals", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    storm = make_storm(args.signals, args.seed)
+    configs = [
+        ("per receiver", setup_per_receiver),
+        ("catch-all", setup_router([None])),
+        ("per interface", setup_router(MIRRORED_INTERFACES))
+    ]
+
+    print(f"{args.signals} signals, {sum(1 for p, i, c in storm if i in MIRRORED_INTERFACES)} on mirrored interfaces")
+    print(f"{'subscription':>14} {'rules':>6} {'deliveries':>11} {'handler calls':>14} {'us/signal':>10}")
+    for name, setup in configs:
+        rules, deliveries, calls, elapsed = run(setup, storm)
+        print(f"{name:>14} {rules:>6} {deliveries:>11} {calls:>14} {elapsed / args.signals * 1e6:>10.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -5,58 +5,93 @@ from threads.playback_control import PlaybackControlThread
 from threads.call_handler import VoiceCallHandlerThread
 from threads.bluetooth_control import BluetoothControlThread
 from threads.web_server import WebServerThread
+from threads import metrics
 
 from time import sleep
-import logging, atexit
+import logging, atexit, sys, signal
 
 GLOBAL_LOGGING_LEVEL = logging.DEBUG
+CONNECTION_TIMEOUT = None # Seconds to wait for a device to connect, None waits forever
+MEDIA_TIMEOUT = 10 # Seconds to wait for the connected device's media player and transport
+MAX_VOLUME_RATE = 20 # Most volume changes applied per second
+ALBUM_ART_CACHE_DIR = "/tmp/carDashboard/albumArt" # Must be writable, the root FS is read-only
+ALBUM_ART_SIZES = [300] # Sizes in pixels album art is shown at on the dashboard
+ALBUM_ART_PREFETCH_DEPTH = 3 # Upcoming tracks to fetch album art for ahead of time, 0 turns it off
+WEB_SERVER_PORT = 5000
+WEB_SERVER_WORKERS = 8 # Request threads, each open /events stream holds one
+METRICS_ENABLED = False # Record hot path latencies and serve them on /metrics
 
 # Threads
 threads = {}
 
 def exitHandler():
+    # Stop serving first so clients aren't left hanging
+    if "wst" in threads:
+        threads["wst"].stop()
+
     # Disconnect all connected devices
-    for device in threads["bct"].get_all_connected():
+    for device in (threads["bct"].get_all_connected() if "bct" in threads else []):
         print(device["obj"])
         device["obj"].Disconnect()
+
+    # Every thread shares one DBus main loop, stop it once everything is disconnected
+    if "bct" in threads:
+        threads["bct"].runtime.stop()
     
     print("Exiting application...")
 
-def playbackPropertyChangeCallback(pct, changed):
-    albumArtImgLink = ""
+# SIGTERM (from systemd) and SIGINT exit normally, so exitHandler gets run
+def signalHandler(signum, frame):
+    sys.exit(0)
 
+def playbackPropertyChangeCallback(pct, changed):
     for prop, value in changed.items():
         if prop == "Status":
-            # Update status on screen
+            # Status is already in the state store, the web server picks it up from there
             continue
         elif prop == "Track":
-            # Update track on screen
-            albumArtImgLink = pct.getAlbumArt()
+            # Placeholder shows until the album art is found in the background
+            pct.requestAlbumArt(albumArtFoundCallback)
             continue
 
-    # Update web server thread with information
-    threads["wst"].update_data(pct.trackInfo, pct.playbackStatus, albumArtImgLink)
+# Run on the album art worker once art is found for the track that's still playing
+def albumArtFoundCallback(trackInfo, albumArtImgLink):
+    if trackInfo == threads["pct"].trackInfo:
+        threads["wst"].set_album_art(albumArtImgLink)
+
+# Album art couldn't be fetched while offline, try again for the current track once we're back
+def connectivityChangeCallback(online):
+    if online:
+        threads["pct"].requestAlbumArt(albumArtFoundCallback)
 
 if __name__ == "__main__":
     # Register exit handler
     atexit.register(exitHandler)
+    signal.signal(signal.SIGTERM, signalHandler)
+    signal.signal(signal.SIGINT, signalHandler)
+    metrics.enable(METRICS_ENABLED)
 
+    # Serve right away, beside the DBus threads, so the dashboard is up while waiting for a phone
     threads["wst"] = WebServerThread(GLOBAL_LOGGING_LEVEL)
+    threads["wst"].start(port=WEB_SERVER_PORT, workers=WEB_SERVER_WORKERS)
     
     # Start bluetooth thread and wait for connection
     threads["bct"] = BluetoothControlThread(GLOBAL_LOGGING_LEVEL)
-    threads["bct"].wait_for_connection()
+    device = threads["bct"].wait_for_connection(CONNECTION_TIMEOUT)
+    if device is None:
+        print("No device connected in time, exiting...")
+        sys.exit(1)
 
-    # Wait before starting other threads
-    sleep(1.5)
+    # Other threads need the player and transport, start them as soon as BlueZ has added both
+    threads["bct"].wait_for_media(device["path"], MEDIA_TIMEOUT)
 
     # Start other threads
-    threads["vct"] = VolumeControlThread(GLOBAL_LOGGING_LEVEL)
-    threads["pct"] = PlaybackControlThread(GLOBAL_LOGGING_LEVEL, playbackPropertyChangeCallback)
+    threads["vct"] = VolumeControlThread(GLOBAL_LOGGING_LEVEL, MAX_VOLUME_RATE)
+    threads["pct"] = PlaybackControlThread(GLOBAL_LOGGING_LEVEL, playbackPropertyChangeCallback, ALBUM_ART_CACHE_DIR, ALBUM_ART_SIZES, ALBUM_ART_PREFETCH_DEPTH)
+    threads["pct"].connectivity.add_listener(connectivityChangeCallback)
+    threads["wst"].set_art_cache(threads["pct"].albumArtCache)
     # threads["vcht"] = VoiceCallHandlerThread(GLOBAL_LOGGING_LEVEL)
 
-    threads["wst"].run()
-    
     """
     sleep(20)
     pct.play()
@@ -66,5 +101,6 @@ if __name__ == "__main__":
     # pct.nextTrack()
     """
     
-    input("Press return to exit...")
-
+    # Everything runs on other threads, keep the process alive until a signal asks it to stop
+    while True:
+        signal.pause()
@@ -0,0 +1,5 @@
+import os, sys
+
+# Tests import the app's modules as threads.*, and the fakes next to them by name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -0,0 +1,46 @@
+# Stand-in for the pactl commands SubprocessBackend runs, talking to the FakePulseServer at $FAKE_PULSE_SERVER
+# Parses volumes the way pactl does: "50%" is a share of PA_VOLUME_NORM, a decimal like "0.50" is a linear factor
+# converted with pa_sw_volume_from_linear (cube root), and a plain integer is a raw volume
+
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_pulse import ENV_SOCKET, request, subscribe
+
+PA_VOLUME_NORM = 0x10000
+
+def parse_volume(value: str) -> float:
+    if value.endswith("%"):
+        return float(value[:-1]) / 100
+    if "." in value:
+        linear = float(value)
+        return linear ** (1 / 3) if linear > 0 else 0.0
+    return int(value) / PA_VOLUME_NORM
+
+def main(args):
+    path = os.environ[ENV_SOCKET]
+
+    if args[:3] == ["list", "short", "sources"]:
+        for source in request(path, op="list")["sources"]:
+            print(f"{source['index']}\t{source['name']}\tmodule-bluez5-device.c\ts16le {source['channels']}ch 44100Hz\tRUNNING")
+        return 0
+
+    if args[:1] == ["set-source-volume"] and len(args) == 3:
+        source = next((s for s in request(path, op="list")["sources"] if str(s["index"]) == args[1]), None)
+        if source is None:
+            print("Failure: No such entity", file=sys.stderr)
+            return 1
+        reply = request(path, op="set", index=source["index"], volume=[parse_volume(args[2])] * source["channels"])
+        return 0 if reply.get("ok") else 1
+
+    if args == ["subscribe"]:
+        sock, events = subscribe(path)
+        for event in events:
+            print(f"Event '{event['event']}' on source #{event['index']}", flush=True)
+        return 0
+
+    print(f"Unsupported: {' '.join(args)}", file=sys.stderr)
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,124 @@
+# Fake audio server for testing the audio backends without audio hardware
+# Listens on a unix socket and keeps a list of sources with their volumes, speaking JSON lines:
+#   {"op": "list"}                              -> {"sources": [{"index", "name", "channels", "volume"}]}
+#   {"op": "set", "index": 3, "volume": [...]}  -> {"ok": true} or {"error": "..."}
+#   {"op": "subscribe"}                         -> {"event": "new" | "remove", "index": 3} for every change after
+# Volumes are fractions of PA_VOLUME_NORM, like pulsectl uses
+# fake_pactl.py and fake_pulsectl.py are the clients the two backends are pointed at
+# close() drops every client connection too, like the server crashing
+
+import json, os, socket, socketserver, threading, itertools
+
+ENV_SOCKET = "FAKE_PULSE_SERVER" # Socket path the fake pactl connects to
+
+class FakePulseServer:
+    def __init__(self, path):
+        self.path = path
+        self.sources = {} # {index: {"name", "channels", "volume"}}
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.indexes = itertools.count(1)
+        self.requests = [] # Ops received, in order
+        self.connections = [] # Client sockets, closed with the server
+
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                with server.lock:
+                    server.connections.append(self.connection)
+                for line in self.rfile:
+                    reply = server.handle(json.loads(line), self.wfile)
+                    if reply is None:
+                        # Subscribed, events are written by notify() until the client goes away
+                        self.rfile.read()
+                        return
+                    self.wfile.write((json.dumps(reply) + "\n").encode())
+                    self.wfile.flush()
+
+        self.server = socketserver.ThreadingUnixStreamServer(path, Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    # Server string pulsectl takes
+    @property
+    def address(self):
+        return f"unix:{self.path}"
+
+    def handle(self, request, wfile):
+        op = request["op"]
+        with self.lock:
+            self.requests.append(op)
+
+            if op == "list":
+                return {"sources": [{"index": index, **source} for index, source in sorted(self.sources.items())]}
+            elif op == "set":
+                source = self.sources.get(request["index"])
+                if source is None:
+                    return {"error": f"No such entity: {request['index']}"}
+                source["volume"] = list(request["volume"])
+                return {"ok": True}
+            elif op == "subscribe":
+                self.subscribers.append(wfile)
+                return None
+            return {"error": f"Unknown op: {op}"}
+
+    def notify(self, event, index):
+        line = (json.dumps({"event": event, "index": index}) + "\n").encode()
+        for wfile in list(self.subscribers):
+            try:
+                wfile.write(line)
+                wfile.flush()
+            except OSError:
+                self.subscribers.remove(wfile)
+
+    def add_source(self, name, channels=2):
+        with self.lock:
+            index = next(self.indexes)
+            self.sources[index] = {"name": name, "channels": channels, "volume": [1.0] * channels}
+            self.notify("new", index)
+        return index
+
+    def remove_source(self, index):
+        with self.lock:
+            del self.sources[index]
+            self.notify("remove", index)
+
+    def volume(self, index):
+        with self.lock:
+            return list(self.sources[index]["volume"])
+
+    def count(self, op):
+        with self.lock:
+            return self.requests.count(op)
+
+    def subscriber_count(self):
+        with self.lock:
+            return len(self.subscribers)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        with self.lock:
+            for connection in self.connections:
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+# One request and its reply, used by the fake clients
+def request(path, **message):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall((json.dumps(message) + "\n").encode())
+        return json.loads(sock.makefile("rb").readline())
+
+# Yields events from the server until the connection is closed
+def subscribe(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    sock.sendall(b'{"op": "subscribe"}\n')
+    return sock, (json.loads(line) for line in sock.makefile("rb"))
@@ -0,0 +1,76 @@
+# Stand-in for the parts of pulsectl PulseBackend uses, talking to a FakePulseServer instead of libpulse
+# Like a real client it keeps one connection, which stays broken once the server goes away
+
+import json, socket
+from types import SimpleNamespace
+
+from fake_pulse import subscribe
+
+class PulseError(Exception):
+    pass
+
+class PulseLoopStop(Exception):
+    pass
+
+class PulseVolumeInfo:
+    def __init__(self, value, channels=1):
+        self.values = [value] * channels
+
+class Pulse:
+    def __init__(self, client_name=None, server=None):
+        self.path = server[len("unix:"):]
+        self.callback = None
+        self.eventSocket = None
+
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.sock.connect(self.path)
+        except OSError as e:
+            self.sock.close()
+            raise PulseError(f"Failed to connect to pulseaudio server: {e}")
+        self.replies = self.sock.makefile("rb")
+
+    def request(self, **message):
+        try:
+            self.sock.sendall((json.dumps(message) + "\n").encode())
+            line = self.replies.readline()
+        except OSError as e:
+            raise PulseError(str(e))
+        if not line:
+            raise PulseError("Connection closed")
+        return json.loads(line)
+
+    def source_list(self):
+        return [
+            SimpleNamespace(index=s["index"], name=s["name"], volume=SimpleNamespace(values=s["volume"]))
+            for s in self.request(op="list")["sources"]
+        ]
+
+    def source_volume_set(self, index, volumeInfo):
+        reply = self.request(op="set", index=index, volume=volumeInfo.values)
+        if "error" in reply:
+            raise PulseError(reply["error"])
+
+    def event_mask_set(self, *masks):
+        pass
+
+    def event_callback_set(self, callback):
+        self.callback = callback
+
+    def event_listen(self):
+        self.eventSocket, events = subscribe(self.path)
+        try:
+            for event in events:
+                self.callback(SimpleNamespace(t=event["event"], index=event["index"], facility="source"))
+        except PulseLoopStop:
+            pass
+        except OSError:
+            pass
+
+    def event_listen_stop(self):
+        if self.eventSocket is not None:
+            self.eventSocket.shutdown(socket.SHUT_RDWR)
+            self.eventSocket.close()
+
+    def close(self):
+        self.sock.close()
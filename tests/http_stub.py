@@ -0,0 +1,70 @@
+# Local HTTP server for tests that go "online"
+# Routes are set per test, each one is (status, body, headers), with an optional callable run before answering
+
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+class HttpStub:
+    def __init__(self):
+        self.routes = {} # {path: (status, body, headers, before)}
+        self.hits = {} # {path: request count}
+        self.lock = threading.Lock()
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                path = self.path.split("?")[0]
+                with stub.lock:
+                    stub.hits[path] = stub.hits.get(path, 0) + 1
+                    route = stub.routes.get(path)
+
+                if route is None:
+                    self.send_error(404)
+                    return
+
+                status, body, headers, before = route
+                if before is not None:
+                    before()
+
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+
+                # Without a Content-Length the body is sent chunked, so the size isn't known up front
+                if "Content-Length" in headers:
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for start in range(0, len(body), 4096):
+                    chunk = body[start:start + 4096]
+                    self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+                self.wfile.write(b"0\r\n\r\n")
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.server.server_port}{path}"
+
+    def route(self, path, body=b"", status=200, headers=None, before=None):
+        with self.lock:
+            self.routes[path] = (status, body, headers or {}, before)
+
+    def hit_count(self, path):
+        with self.lock:
+            return self.hits.get(path, 0)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,156 @@
+import logging, threading, time, json
+
+import pytest
+import requests
+
+from threads.album_art_worker import AlbumArtWorker
+from threads.art_image import download_image
+from threads.http_client import HttpClient
+from threads.lookup_cache import AlbumLookupCache
+
+from http_stub import HttpStub
+
+logger = logging.getLogger("test_album_art")
+
+def track(title, album="Album"):
+    return {"Title": title, "Artist": "Artist", "Album": album}
+
+@pytest.fixture
+def stub():
+    stub = HttpStub()
+    yield stub
+    stub.close()
+
+@pytest.fixture
+def client():
+    client = HttpClient(timeout=5, retries=0)
+    yield client
+    client.close()
+
+# Worker
+
+def test_stale_lookups_are_cancelled_and_not_shown(stub, client):
+    release = threading.Event()
+    started = threading.Event()
+
+    def hold():
+        started.set()
+        release.wait(5)
+
+    stub.route("/slow", b"slow-art", before=hold)
+    stub.route("/fast", b"fast-art")
+
+    def lookup(trackInfo):
+        return client.get(stub.url(trackInfo["Title"])).content.decode()
+
+    shown = []
+    worker = AlbumArtWorker(lookup, logger)
+    try:
+        first = worker.submit(track("/slow"), lambda t, link: shown.append(link))
+        assert started.wait(5)
+
+        # Track changes twice while the first lookup is still waiting on the network
+        skipped = worker.submit(track("/fast", "Skipped"), lambda t, link: shown.append(link))
+        current = worker.submit(track("/fast", "Current"), lambda t, link: shown.append(link))
+        release.set()
+
+        assert current.result(5) == "fast-art"
+        # The in-flight lookup finishes, but its art is for a track that's no longer playing
+        assert first.result(5) == "slow-art"
+        assert skipped.cancelled()
+        assert shown == ["fast-art"]
+        assert stub.hit_count("/fast") == 1
+    finally:
+        release.set()
+        worker.stop()
+
+def test_full_queue_drops_the_oldest_request():
+    release = threading.Event()
+    worker = AlbumArtWorker(lambda t: release.wait(5) and t["Title"], logger, maxQueue=2)
+    try:
+        running = worker.submit(track("running"))
+        time.sleep(0.1)
+        oldest = worker.submit(track("oldest"))
+        worker.submit(track("middle"))
+        newest = worker.submit(track("newest"))
+
+        # Dropped as soon as the queue filled up, not later for being stale
+        assert worker.requests.qsize() == 2
+        assert oldest.cancelled()
+        release.set()
+
+        assert running.result(5) == "running"
+        assert newest.result(5) == "newest"
+    finally:
+        release.set()
+        worker.stop()
+
+# Download size cap
+
+def test_download_under_the_cap(stub, client):
+    stub.route("/img", b"x" * 1000, headers={"Content-Length": "1000"})
+    assert download_image(client, stub.url("/img"), maxBytes=2000) == b"x" * 1000
+
+def test_download_rejects_declared_size_over_the_cap(stub, client):
+    stub.route("/img", b"x" * 5000, headers={"Content-Length": "5000"})
+    with pytest.raises(ValueError):
+        download_image(client, stub.url("/img"), maxBytes=2000)
+
+def test_download_stops_streaming_past_the_cap(stub, client):
+    # Chunked, so the size is only found out while reading
+    stub.route("/img", b"x" * 50000)
+    with pytest.raises(ValueError):
+        download_image(client, stub.url("/img"), maxBytes=10000)
+
+def test_download_raises_on_http_errors(stub, client):
+    with pytest.raises(requests.HTTPError):
+        download_image(client, stub.url("/missing"))
+
+# Lookup cache
+
+def test_lookup_cache_persists_hits_and_misses(tmp_path):
+    path = str(tmp_path / "lookups.json")
+    cache = AlbumLookupCache(path, logger=logger)
+    assert cache.get("Artist", "Album") is None
+
+    cache.put_hit("Artist", "Album", "https://example.com/cover.jpg")
+    cache.put_miss("Podcast", "Episode")
+
+    reloaded = AlbumLookupCache(path, logger=logger)
+    assert reloaded.get("Artist", "Album") == "https://example.com/cover.jpg"
+    assert reloaded.get("Podcast", "Episode") == ""
+    # Keys are normalized, so case and spacing don't matter
+    assert reloaded.get("  artist ", "ALBUM") == "https://example.com/cover.jpg"
+
+def test_lookup_cache_expires_entries(tmp_path, monkeypatch):
+    path = str(tmp_path / "lookups.json")
+    cache = AlbumLookupCache(path, hitTtl=100, missTtl=10, logger=logger)
+    cache.put_hit("Artist", "Album", "https://example.com/cover.jpg")
+    cache.put_miss("Podcast", "Episode")
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 50)
+    assert cache.get("Podcast", "Episode") is None
+    assert cache.get("Artist", "Album") == "https://example.com/cover.jpg"
+
+    # Expired entries aren't loaded back either
+    monkeypatch.setattr(time, "time", lambda: now + 200)
+    assert AlbumLookupCache(path, logger=logger).get("Artist", "Album") is None
+
+def test_lookup_cache_starts_fresh_when_unreadable(tmp_path):
+    path = tmp_path / "lookups.json"
+    path.write_text("not json")
+    cache = AlbumLookupCache(str(path), logger=logger)
+    assert cache.get("Artist", "Album") is None
+
+    cache.put_hit("Artist", "Album", "https://example.com/cover.jpg")
+    assert json.loads(path.read_text())
+
+def test_lookup_cache_forget(tmp_path):
+    path = str(tmp_path / "lookups.json")
+    cache = AlbumLookupCache(path, logger=logger)
+    cache.put_hit("Artist", "Album", "https://example.com/gone.jpg")
+
+    cache.forget("Artist", "Album")
+    assert cache.get("Artist", "Album") is None
+    assert AlbumLookupCache(path, logger=logger).get("Artist", "Album") is None
@@ -0,0 +1,59 @@
+import hashlib, logging, os
+
+from threads.art_cache import AlbumArtCache
+
+logger = logging.getLogger("test_art_cache")
+
+def digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+def test_stores_on_disk(tmp_path):
+    cache = AlbumArtCache(str(tmp_path), logger=logger)
+    path = cache.put("Artist", "Album", b"cover", size=300)
+
+    assert path == os.path.join(str(tmp_path), digest(b"cover") + ".jpg")
+    assert open(path, "rb").read() == b"cover"
+    assert cache.get_path("artist", "album", 300) == path
+
+    # Index survives a restart
+    assert AlbumArtCache(str(tmp_path), logger=logger).get_path("Artist", "Album", 300) == path
+
+def test_memory_only_when_not_writable(tmp_path):
+    # A directory can't be made under a file, so the cache can't use disk at all
+    blocker = tmp_path / "file"
+    blocker.write_bytes(b"")
+    cache = AlbumArtCache(str(blocker / "art"), memoryEntries=2, logger=logger)
+    assert not cache.writable
+
+    # Locations are file names the /art route can serve from memory
+    name = cache.put("Artist", "Album", b"cover", size=300)
+    assert name == digest(b"cover") + ".jpg"
+    assert cache.get_path("Artist", "Album", 300) == name
+    assert cache.get_bytes(digest(b"cover")) == b"cover"
+
+def test_memory_only_forgets_evicted_images(tmp_path):
+    blocker = tmp_path / "file"
+    blocker.write_bytes(b"")
+    cache = AlbumArtCache(str(blocker / "art"), memoryEntries=2, logger=logger)
+
+    cache.put("A", "1", b"one")
+    cache.put("B", "2", b"two")
+    # Looking A up makes it the most recently used, so B is the one pushed out
+    assert cache.get_path("A", "1")
+    cache.put("C", "3", b"three")
+
+    assert cache.get_path("B", "2") is None
+    assert cache.get_bytes(digest(b"two")) is None
+    assert cache.get_path("A", "1") == digest(b"one") + ".jpg"
+    assert cache.get_path("C", "3") == digest(b"three") + ".jpg"
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = AlbumArtCache(str(tmp_path), maxEntries=2, logger=logger)
+    first = cache.put("A", "1", b"one")
+    cache.put("B", "2", b"two")
+    cache.get_path("A", "1")
+    cache.put("C", "3", b"three")
+
+    assert cache.get_path("B", "2") is None
+    assert not os.path.exists(os.path.join(str(tmp_path), digest(b"two") + ".jpg"))
+    assert cache.get_path("A", "1") == first
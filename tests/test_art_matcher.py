@@ -0,0 +1,26 @@
+import json, os
+
+import pytest
+
+from threads.art_matcher import normalize, artist_similarity, best_match, ARTIST_MIN
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "album_matches.json")
+
+with open(FIXTURES, encoding="utf-8") as fixtureFile:
+    CASES = json.load(fixtureFile)
+
+@pytest.mark.parametrize("case", CASES, ids=[case["note"] for case in CASES])
+def test_labeled_matches(case):
+    match = best_match(case["candidates"], case["track"])
+    assert (match and match["id"]) == case["expected"]
+
+def test_edition_words_only_match_whole_words():
+    assert normalize("Wish You Were Here (Live)") == "wish you were here"
+    assert normalize("Rumours - 2004 Remaster") == "rumours"
+    assert normalize("Selected Works (Deep Cuts)") == "selected works deep cuts"
+    assert normalize("Human After All - Alive") == "human after all alive"
+
+def test_sub_credit_alone_is_not_the_same_artist():
+    assert artist_similarity("Mumford & Sons", "Sons") < ARTIST_MIN
+    assert artist_similarity("Mumford & Sons", "Mumford & Sons") == 1.0
+    assert artist_similarity("Post Malone, Swae Lee", "Post Malone") == 1.0
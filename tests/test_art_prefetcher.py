@@ -0,0 +1,160 @@
+import logging, threading, time
+
+import pytest
+
+# Listing the now playing items is a dbus-python call, so the module needs it even though no bus is used here
+dbus = pytest.importorskip("dbus")
+
+from threads.art_prefetcher import ArtPrefetcher
+from threads.art_image import MAX_DOWNLOAD_BYTES
+
+PLAYER = "/org/bluez/hci0/dev_AA_BB_CC_DD_EE_FF/player0"
+PLAYLIST = PLAYER + "/NowPlaying"
+
+logger = logging.getLogger("test_art_prefetcher")
+
+def track(i):
+    return {"Title": f"Track {i}", "Artist": f"Artist {i}", "Album": f"Album {i}"}
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+# MediaFolder1 the way BlueZ has it: on the player, listing whichever folder it was changed to
+class FakeFolder:
+    def __init__(self, tracks):
+        self.tracks = tracks
+        self.folder = PLAYER
+
+    def ChangeFolder(self, path):
+        self.folder = str(path)
+
+    def ListItems(self, filter):
+        if self.folder != PLAYLIST:
+            raise dbus.exceptions.DBusException("org.bluez.Error.NotSupported")
+        # a{oa{sv}} comes back as a dictionary keyed by item path
+        return dbus.Dictionary(
+            {f"{PLAYLIST}/item{i}": {"Name": t["Title"], "Metadata": t} for i, t in enumerate(self.tracks)},
+            signature="oa{sv}"
+        )
+
+class FakeObjects:
+    def get_property(self, path, interface, prop, default=None):
+        if (path, interface, prop) == (PLAYER, "org.bluez.MediaPlayer1", "Playlist"):
+            return PLAYLIST
+        return default
+
+# Stands in for PlaybackControlThread, getAlbumArt holds until the test releases it
+class FakePlayback:
+    playerPath = PLAYER
+    albumArtSizes = [300]
+
+    def __init__(self, tracks):
+        self.folder = FakeFolder(tracks)
+        self.bluezObjects = FakeObjects()
+        self.albumArtCache = type("Cache", (), {"get_path": lambda self, artist, album, size: None})()
+        self.interfaces = []
+
+        self.release = threading.Event()
+        self.lock = threading.Lock()
+        self.fetched = [] # (album, maxBytes) in the order fetches started
+        self.running = 0
+        self.maxRunning = 0
+
+    def get_interface(self, busName, path, interface):
+        self.interfaces.append((path, interface))
+        if (path, interface) != (PLAYER, "org.bluez.MediaFolder1"):
+            raise dbus.exceptions.DBusException("org.freedesktop.DBus.Error.UnknownObject")
+        return self.folder
+
+    def getAlbumArt(self, trackInfo, maxBytes=None):
+        with self.lock:
+            self.fetched.append((trackInfo["Album"], maxBytes))
+            self.running += 1
+            self.maxRunning = max(self.maxRunning, self.running)
+        self.release.wait(5)
+        with self.lock:
+            self.running -= 1
+
+    def albums(self):
+        with self.lock:
+            return sorted(album for album, maxBytes in self.fetched)
+
+def make_prefetcher(playback, **kwargs):
+    return ArtPrefetcher(playback, logger, **kwargs)
+
+def test_fetches_the_next_tracks_up_to_the_depth():
+    playback = FakePlayback([track(i) for i in range(6)])
+    playback.release.set()
+    prefetcher = make_prefetcher(playback, depth=3)
+    try:
+        prefetcher.track_changed(track(1))
+        assert wait_for(lambda: len(playback.albums()) == 3)
+        time.sleep(0.1)
+        assert playback.albums() == ["Album 2", "Album 3", "Album 4"]
+        assert playback.folder.folder == PLAYLIST
+    finally:
+        prefetcher.stop()
+
+def test_unknown_position_fetches_nothing():
+    playback = FakePlayback([track(i) for i in range(3)])
+    playback.release.set()
+    prefetcher = make_prefetcher(playback)
+    try:
+        prefetcher.track_changed(track(9))
+        time.sleep(0.2)
+        assert playback.fetched == []
+    finally:
+        prefetcher.stop()
+
+def test_at_most_two_fetches_at_once():
+    playback = FakePlayback([track(i) for i in range(6)])
+    prefetcher = make_prefetcher(playback, depth=4, maxBytes=10 * MAX_DOWNLOAD_BYTES)
+    try:
+        prefetcher.track_changed(track(0))
+        assert wait_for(lambda: playback.maxRunning == 2)
+        time.sleep(0.1)
+        assert len(playback.fetched) == 2
+
+        playback.release.set()
+        assert wait_for(lambda: len(playback.fetched) == 4)
+        assert playback.maxRunning == 2
+    finally:
+        playback.release.set()
+        prefetcher.stop()
+
+def test_round_stays_within_its_byte_budget():
+    playback = FakePlayback([track(i) for i in range(6)])
+    playback.release.set()
+    prefetcher = make_prefetcher(playback, depth=4, maxBytes=MAX_DOWNLOAD_BYTES + MAX_DOWNLOAD_BYTES // 2)
+    try:
+        prefetcher.track_changed(track(0))
+        assert wait_for(lambda: len(playback.fetched) == 2)
+        time.sleep(0.2)
+
+        # One full download and what's left of the budget, then nothing more this round
+        assert sorted(maxBytes for album, maxBytes in playback.fetched) == [MAX_DOWNLOAD_BYTES // 2, MAX_DOWNLOAD_BYTES]
+    finally:
+        prefetcher.stop()
+
+def test_track_change_cancels_the_rest_of_the_round():
+    playback = FakePlayback([track(i) for i in range(8)])
+    prefetcher = make_prefetcher(playback, depth=4, maxBytes=10 * MAX_DOWNLOAD_BYTES)
+    try:
+        prefetcher.track_changed(track(0))
+        # Both workers are busy with Album 1 and 2, Album 3 and 4 are still queued
+        assert wait_for(lambda: len(playback.fetched) == 2)
+
+        prefetcher.track_changed(track(4))
+        playback.release.set()
+        assert wait_for(lambda: "Album 7" in playback.albums())
+        time.sleep(0.1)
+
+        assert playback.albums() == ["Album 1", "Album 2", "Album 5", "Album 6", "Album 7"]
+    finally:
+        playback.release.set()
+        prefetcher.stop()
@@ -0,0 +1,133 @@
+import logging, os, sys, stat, time
+
+import pytest
+
+from threads import audio_backend
+from threads.audio_backend import AudioBackend, PulseBackend, SubprocessBackend, linear_to_volume
+
+import fake_pulsectl
+from fake_pulse import FakePulseServer, ENV_SOCKET
+
+ADDRESS = "AA:BB:CC:DD:EE:FF"
+SOURCE_NAME = "bluez_source.AA_BB_CC_DD_EE_FF.a2dp_source"
+
+logger = logging.getLogger("test_audio_backend")
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+@pytest.fixture
+def server():
+    # Unix socket paths are limited to about 100 characters, so keep it short
+    path = f"/tmp/fake-pulse-{os.getpid()}-{time.monotonic_ns()}.sock"
+    server = FakePulseServer(path)
+    yield server
+    server.close()
+
+@pytest.fixture
+def pulse_backend(server, monkeypatch):
+    monkeypatch.setattr(audio_backend, "pulsectl", fake_pulsectl)
+    backend = PulseBackend(logger, server=server.address)
+    assert wait_for(lambda: server.subscriber_count() == 1)
+    yield backend
+    backend.close()
+
+@pytest.fixture
+def subprocess_backend(server, tmp_path, monkeypatch):
+    # pactl on PATH is a script that runs fake_pactl.py against the fake server
+    pactl = tmp_path / "pactl"
+    pactl.write_text(f"#!/bin/sh\nexec {sys.executable} {os.path.join(os.path.dirname(__file__), 'fake_pactl.py')} \"$@\"\n")
+    pactl.chmod(pactl.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv(ENV_SOCKET, server.path)
+
+    backend = SubprocessBackend(logger)
+    assert wait_for(lambda: server.subscriber_count() == 1)
+    yield backend
+    backend.close()
+
+def test_backend_must_implement_source_methods():
+    with pytest.raises(TypeError):
+        AudioBackend(logger)
+
+def test_linear_to_volume_matches_pactl():
+    assert linear_to_volume(0.5) == pytest.approx(0.7937, abs=1e-4)
+    assert linear_to_volume(1.0) == pytest.approx(1.0)
+    assert linear_to_volume(0.0) == 0.0
+
+@pytest.mark.parametrize("backend_fixture", ["pulse_backend", "subprocess_backend"])
+def test_sets_volume_and_caches_source(backend_fixture, server, request):
+    index = server.add_source(SOURCE_NAME)
+    backend = request.getfixturevalue(backend_fixture)
+
+    assert backend.set_source_volume(ADDRESS, 0.5)
+    assert server.volume(index) == pytest.approx([0.7937, 0.7937], abs=1e-3)
+
+    # Second change reuses the cached index, the fake pactl still lists sources to find the channel count
+    lists = server.count("list")
+    assert backend.set_source_volume(ADDRESS, 0.25)
+    assert backend.address_to_index(ADDRESS) is not None
+    assert server.count("list") - lists <= (1 if backend_fixture == "subprocess_backend" else 0)
+    assert server.volume(index) == pytest.approx([linear_to_volume(0.25)] * 2, abs=1e-3)
+
+@pytest.mark.parametrize("backend_fixture", ["pulse_backend", "subprocess_backend"])
+def test_source_events_invalidate_the_cache(backend_fixture, server, request):
+    oldIndex = server.add_source(SOURCE_NAME)
+    backend = request.getfixturevalue(backend_fixture)
+    assert backend.set_source_volume(ADDRESS, 1.0)
+
+    # Phone reconnects, its source comes back under a new index
+    server.remove_source(oldIndex)
+    assert wait_for(lambda: not backend.sources)
+    newIndex = server.add_source(SOURCE_NAME)
+
+    assert backend.set_source_volume(ADDRESS, 0.5)
+    assert str(backend.address_to_index(ADDRESS)) == str(newIndex)
+    assert server.volume(newIndex) == pytest.approx([0.7937, 0.7937], abs=1e-3)
+
+@pytest.mark.parametrize("backend_fixture", ["pulse_backend", "subprocess_backend"])
+def test_missing_source(backend_fixture, server, request):
+    server.add_source("bluez_source.11_22_33_44_55_66.a2dp_source")
+    backend = request.getfixturevalue(backend_fixture)
+    assert not backend.set_source_volume(ADDRESS, 0.5)
+
+def test_backends_agree_on_volume(server, request):
+    pulseIndex = server.add_source(SOURCE_NAME)
+    request.getfixturevalue("pulse_backend").set_source_volume(ADDRESS, 0.6)
+    pulseVolume = server.volume(pulseIndex)
+    server.remove_source(pulseIndex)
+
+    subprocessIndex = server.add_source(SOURCE_NAME)
+    request.getfixturevalue("subprocess_backend").set_source_volume(ADDRESS, 0.6)
+
+    assert server.volume(subprocessIndex) == pytest.approx(pulseVolume, abs=0.01)
+
+def test_pulse_backend_reconnects_after_a_server_restart(server, request, monkeypatch):
+    monkeypatch.setattr(PulseBackend, "RECONNECT_MIN", 0.05)
+    monkeypatch.setattr(PulseBackend, "RECONNECT_MAX", 0.2)
+    server.add_source(SOURCE_NAME)
+    backend = request.getfixturevalue("pulse_backend")
+    assert backend.set_source_volume(ADDRESS, 1.0)
+
+    # Server crashes, volume changes fail instead of raising
+    server.close()
+    assert not backend.set_source_volume(ADDRESS, 0.5)
+    assert not backend.set_source_volume(ADDRESS, 0.5)
+
+    restarted = FakePulseServer(server.path)
+    try:
+        index = restarted.add_source(SOURCE_NAME)
+        assert wait_for(lambda: backend.set_source_volume(ADDRESS, 0.5))
+        assert restarted.volume(index) == pytest.approx([0.7937, 0.7937], abs=1e-3)
+
+        # Events come from the new server as well
+        assert wait_for(lambda: restarted.subscriber_count() == 1)
+        restarted.remove_source(index)
+        assert wait_for(lambda: not backend.sources)
+    finally:
+        restarted.close()
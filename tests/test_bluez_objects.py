@@ -0,0 +1,65 @@
+import logging, threading
+
+import pytest
+
+# The mirror talks to BlueZ through dbus-python, so the module needs it even though no bus is used here
+dbus = pytest.importorskip("dbus")
+
+from threads.bluez_objects import BluezObjectCache, DEVICE_INTERFACE
+
+DEVICE = "/org/bluez/hci0/dev_AA_BB_CC_DD_EE_FF"
+
+# Remote object that answers GetManagedObjects from whatever the test says BlueZ has right now
+class FakeManager:
+    def __init__(self, bus):
+        self.bus = bus
+
+    def get_dbus_method(self, member, dbus_interface=None):
+        def call(*args):
+            if self.bus.objects is None:
+                raise dbus.exceptions.DBusException("org.freedesktop.DBus.Error.ServiceUnknown")
+            return self.bus.objects
+        return call
+
+class FakeBus:
+    def __init__(self, objects):
+        self.objects = objects
+
+    def get_object(self, busName, path):
+        return FakeManager(self)
+
+# Mirror without its signal subscriptions, the handlers are called directly
+def make_mirror(bus):
+    mirror = BluezObjectCache.__new__(BluezObjectCache)
+    mirror.bus = bus
+    mirror.objects = {}
+    mirror.lock = threading.RLock()
+    mirror.logger = logging.getLogger("test_bluez_objects")
+    mirror.refresh()
+    return mirror
+
+def test_bluez_leaving_clears_the_mirror():
+    bus = FakeBus({DEVICE: {DEVICE_INTERFACE: {"Connected": True}}})
+    mirror = make_mirror(bus)
+    assert mirror.find_paths(DEVICE_INTERFACE) == [DEVICE]
+
+    mirror._name_owner_changed("org.bluez", ":1.10", "")
+    assert mirror.get_managed_objects() == {}
+
+def test_bluez_restarting_reloads_the_mirror():
+    bus = FakeBus({DEVICE: {DEVICE_INTERFACE: {"Connected": True}}})
+    mirror = make_mirror(bus)
+
+    # Came back without the device, and nothing said it was removed
+    bus.objects = {"/org/bluez/hci0": {"org.bluez.Adapter1": {"Powered": True}}}
+    mirror._name_owner_changed("org.bluez", ":1.10", ":1.42")
+    assert mirror.find_paths(DEVICE_INTERFACE) == []
+    assert mirror.find_adapter() == "/org/bluez/hci0"
+
+def test_failed_reload_leaves_nothing_stale():
+    bus = FakeBus({DEVICE: {DEVICE_INTERFACE: {"Connected": True}}})
+    mirror = make_mirror(bus)
+
+    bus.objects = None
+    mirror._name_owner_changed("org.bluez", "", ":1.42")
+    assert mirror.get_managed_objects() == {}
@@ -0,0 +1,90 @@
+import logging, threading, time
+
+from threads.connectivity import ConnectivityMonitor
+
+logger = logging.getLogger("test_connectivity")
+
+# Probe that answers from a switch the test flips, counting how often it's asked
+class FakeNetwork:
+    def __init__(self, up=True):
+        self.up = up
+        self.probes = 0
+        self.lock = threading.Lock()
+
+    def probe(self):
+        with self.lock:
+            self.probes += 1
+        return self.up
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+def test_failures_back_off_even_when_the_probe_succeeds():
+    # The probe gets through but the service behind it doesn't, every time we come online the lookup fails again
+    network = FakeNetwork(up=False)
+    monitor = ConnectivityMonitor(logger, probeFunc=network.probe, interval=60, minBackoff=0.1, maxBackoff=10)
+    monitor.add_listener(lambda online: online and monitor.report_failure())
+    network.up = True
+    try:
+        time.sleep(1)
+        # Only a few rounds of growing backoff fit in a second, not a tight loop
+        assert 2 <= network.probes <= 5
+        assert monitor.backoff >= 0.8
+    finally:
+        monitor.stop()
+
+def test_success_resets_the_backoff():
+    network = FakeNetwork(up=False)
+    monitor = ConnectivityMonitor(logger, probeFunc=network.probe, interval=60, minBackoff=0.05, maxBackoff=10)
+    try:
+        assert wait_for(lambda: network.probes >= 3)
+        assert not monitor.is_online()
+        assert monitor.backoff >= 0.2
+
+        monitor.report_success()
+        assert monitor.is_online()
+        assert monitor.backoff == 0.05
+    finally:
+        monitor.stop()
+
+def test_comes_back_online_after_an_outage():
+    network = FakeNetwork(up=False)
+    changes = []
+    monitor = ConnectivityMonitor(logger, probeFunc=network.probe, interval=60, minBackoff=0.05, maxBackoff=0.1)
+    monitor.add_listener(changes.append)
+    try:
+        assert wait_for(lambda: network.probes >= 2)
+        network.up = True
+        assert wait_for(monitor.is_online)
+        assert changes == [True]
+
+        # Online now, so nothing else is probed until the interval or someone asks
+        probes = network.probes
+        time.sleep(0.3)
+        assert network.probes == probes
+
+        monitor.check_now()
+        assert wait_for(lambda: network.probes == probes + 1)
+    finally:
+        monitor.stop()
+
+def test_reported_failure_waits_before_probing():
+    network = FakeNetwork(up=True)
+    monitor = ConnectivityMonitor(logger, probeFunc=network.probe, interval=60, minBackoff=0.3, maxBackoff=10)
+    try:
+        assert wait_for(monitor.is_online)
+        probes = network.probes
+
+        monitor.report_failure()
+        assert not monitor.is_online()
+        time.sleep(0.1)
+        assert network.probes == probes
+        assert wait_for(monitor.is_online)
+        assert network.probes == probes + 1
+    finally:
+        monitor.stop()
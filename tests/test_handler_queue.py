@@ -0,0 +1,175 @@
+import logging, threading, time
+
+from threads import metrics
+from threads.handler_queue import HandlerQueue, merge_properties
+
+logger = logging.getLogger("test_handler_queue")
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+# Queue whose worker is held in its first handler until release is set, so later events stay queued
+def held_queue(name, policy, maxSize=2, blockTimeout=1):
+    queue = HandlerQueue(name, logger, maxSize, policy, blockTimeout)
+    started = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        started.set()
+        release.wait(5)
+
+    queue.submit(hold)
+    assert started.wait(5)
+    return queue, release
+
+def test_drop_oldest():
+    queue, release = held_queue("testDropOldest", HandlerQueue.DROP_OLDEST)
+    handled = []
+    try:
+        for i in range(4):
+            assert queue.submit(handled.append, (i,))
+        assert queue.stats()["depth"] == 2
+        assert queue.stats()["dropped"] == 2
+
+        release.set()
+        assert wait_for(lambda: len(handled) == 2)
+        assert handled == [2, 3]
+        assert queue.stats()["maxDepth"] == 2
+    finally:
+        release.set()
+        queue.stop()
+
+def test_coalesce_merges_properties():
+    queue, release = held_queue("testCoalesce", HandlerQueue.COALESCE, maxSize=4)
+    handled = []
+    try:
+        key = ("org.bluez.MediaPlayer1", "/player0")
+        queue.submit(lambda *args: handled.append(args), ("org.bluez.MediaPlayer1", {"Status": "paused", "Position": 1}, ["Track"], "/player0"), key=key, merge=merge_properties)
+        queue.submit(lambda *args: handled.append(args), ("org.bluez.MediaPlayer1", {"Track": {"Title": "A"}}, ["Position", "Repeat"], "/player0"), key=key, merge=merge_properties)
+        # Different key, queued on its own
+        queue.submit(lambda *args: handled.append(args), ("org.bluez.MediaPlayer1", {"Status": "playing"}, [], "/player1"), key=("org.bluez.MediaPlayer1", "/player1"), merge=merge_properties)
+        assert queue.stats()["depth"] == 2
+        assert queue.stats()["coalesced"] == 1
+
+        release.set()
+        assert wait_for(lambda: len(handled) == 2)
+        interface, changed, invalidated, path = handled[0]
+        # Track was changed again after being invalidated, Position was invalidated after being changed
+        assert changed == {"Status": "paused", "Track": {"Title": "A"}}
+        assert sorted(invalidated) == ["Position", "Repeat"]
+        assert path == "/player0"
+        assert handled[1][3] == "/player1"
+    finally:
+        release.set()
+        queue.stop()
+
+def test_coalesce_without_merge_keeps_the_newest():
+    queue, release = held_queue("testCoalesceReplace", HandlerQueue.COALESCE)
+    handled = []
+    try:
+        queue.submit(handled.append, (1,), key="volume")
+        queue.submit(handled.append, (2,), key="volume")
+        release.set()
+        assert wait_for(lambda: handled)
+        time.sleep(0.05)
+        assert handled == [2]
+    finally:
+        release.set()
+        queue.stop()
+
+def test_merge_properties():
+    merged = merge_properties(
+        ("iface", {"A": 1, "B": 2}, ["C"], "/path"),
+        ("iface", {"B": 3, "C": 4}, ["A", "D"], "/path")
+    )
+    assert merged[1] == {"B": 3, "C": 4}
+    assert sorted(merged[2]) == ["A", "D"]
+
+def test_block_waits_for_space():
+    queue, release = held_queue("testBlock", HandlerQueue.BLOCK, maxSize=1, blockTimeout=5)
+    handled = []
+    try:
+        assert queue.submit(handled.append, (1,))
+
+        # Let the worker make room a little later, the second submit waits for it instead of dropping
+        threading.Timer(0.1, release.set).start()
+        start = time.monotonic()
+        assert queue.submit(handled.append, (2,))
+        assert time.monotonic() - start >= 0.05
+
+        assert wait_for(lambda: len(handled) == 2)
+        assert handled == [1, 2]
+        assert queue.stats()["dropped"] == 0
+    finally:
+        release.set()
+        queue.stop()
+
+def test_block_drops_the_new_event_after_the_timeout():
+    queue, release = held_queue("testBlockTimeout", HandlerQueue.BLOCK, maxSize=1, blockTimeout=0.1)
+    handled = []
+    try:
+        assert queue.submit(handled.append, (1,))
+        start = time.monotonic()
+        assert not queue.submit(handled.append, (2,))
+        assert time.monotonic() - start >= 0.1
+        assert queue.stats()["dropped"] == 1
+
+        release.set()
+        assert wait_for(lambda: handled)
+        time.sleep(0.05)
+        assert handled == [1]
+    finally:
+        release.set()
+        queue.stop()
+
+def test_stop_drops_queued_events():
+    queue, release = held_queue("testStop", HandlerQueue.DROP_OLDEST)
+    handled = []
+    queue.submit(handled.append, (1,))
+    queue.submit(handled.append, (2,))
+
+    stopper = threading.Thread(target=queue.stop)
+    stopper.start()
+    assert wait_for(lambda: not queue.running)
+    release.set()
+    stopper.join(5)
+
+    assert not queue.workerThread.is_alive()
+    assert handled == []
+    assert queue.stats()["dropped"] == 2
+    assert not queue.submit(handled.append, (3,))
+
+def test_handler_errors_dont_stop_the_worker():
+    queue = HandlerQueue("testErrors", logger)
+    handled = []
+    try:
+        queue.submit(lambda: 1 / 0)
+        queue.submit(handled.append, (1,))
+        assert wait_for(lambda: handled == [1])
+    finally:
+        queue.stop()
+
+def test_queue_stats_are_exported():
+    queue, release = held_queue("testExported", HandlerQueue.COALESCE)
+    try:
+        queue.submit(print, key="a")
+        queue.submit(print, key="a")
+        queue.submit(print, key="b")
+        queue.submit(print, key="c")
+
+        rendered = metrics.render()
+        assert 'dashboard_handler_queue_depth{queue="testExported"} 2' in rendered
+        assert 'dashboard_handler_queue_max_depth{queue="testExported"} 2' in rendered
+        assert 'dashboard_handler_queue_dropped_total{queue="testExported"} 1' in rendered
+        assert 'dashboard_handler_queue_coalesced_total{queue="testExported"} 1' in rendered
+    finally:
+        release.set()
+        queue.stop()
+
+    # Stopped queues aren't exported anymore
+    assert 'queue="testExported"' not in metrics.render()
@@ -0,0 +1,61 @@
+import logging, threading, time
+
+from threads import metrics
+from threads.volume_coalescer import VolumeCoalescer
+
+logger = logging.getLogger("test_metrics")
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+def test_collector_with_labels():
+    values = {"received": 3, "applied": 1}
+    collector = metrics.Collector("test_updates_total", "Updates", "counter", lambda: dict(values), "stage")
+    assert collector.render() == [
+        "# HELP test_updates_total Updates",
+        "# TYPE test_updates_total counter",
+        'test_updates_total{stage="applied"} 1',
+        'test_updates_total{stage="received"} 3'
+    ]
+
+    # Read again on every render
+    values["applied"] = 2
+    assert 'test_updates_total{stage="applied"} 2' in collector.render()
+
+def test_collector_without_labels():
+    collector = metrics.Collector("test_depth", "Depth", "gauge", lambda: 4)
+    assert collector.render()[-1] == "test_depth 4"
+
+def test_volume_counts_are_exported():
+    release = threading.Event()
+    applied = threading.Event()
+
+    def apply(address, volume):
+        release.wait(5)
+        applied.set()
+
+    coalescer = VolumeCoalescer(apply, logger, maxRate=0)
+    try:
+        metrics.collector("test_volume_updates_total", "Volume updates", "counter",
+            lambda: {stage: count for stage, count in coalescer.stats().items() if stage != "pending"}, "stage")
+
+        coalescer.submit("AA", 10)
+        # First one is being applied, of the next two only the newest is kept
+        assert wait_for(lambda: not coalescer.stats()["pending"])
+        coalescer.submit("AA", 20)
+        coalescer.submit("AA", 30)
+        release.set()
+        assert applied.wait(5)
+
+        rendered = metrics.render()
+        assert 'test_volume_updates_total{stage="received"} 3' in rendered
+        assert 'test_volume_updates_total{stage="dropped"} 1' in rendered
+    finally:
+        coalescer.stop()
+        with metrics.registryLock:
+            metrics.registry.pop("test_volume_updates_total", None)
@@ -0,0 +1,94 @@
+import logging
+
+from threads.signal_router import SignalRouter
+
+PROPERTIES_CHANGED = {"bus_name": "org.bluez", "signal_name": "PropertiesChanged", "dbus_interface": "org.freedesktop.DBus.Properties"}
+
+# Bus that keeps the match rules it's given and delivers signals the way the daemon would filter them
+class FakeBus:
+    def __init__(self):
+        self.rules = []
+
+    def add_signal_receiver(self, handler, path_keyword=None, **match):
+        rule = (handler, match)
+        self.rules.append(rule)
+
+        bus = self
+        class Match:
+            def remove(self):
+                bus.rules.remove(rule)
+        return Match()
+
+    # Returns how many times the signal was delivered to the process
+    def emit(self, path, *args):
+        delivered = 0
+        for handler, match in list(self.rules):
+            if "arg0" in match and match["arg0"] != args[0]:
+                continue
+            delivered += 1
+            handler(*args, path=path)
+        return delivered
+
+    def arg0s(self):
+        return sorted(str(match.get("arg0")) for handler, match in self.rules)
+
+class FakeRuntime:
+    def __init__(self):
+        self.bus = FakeBus()
+        self.logger = logging.getLogger("test_signal_router")
+
+    def timed(self, handler, name=None):
+        return handler
+
+def make_router():
+    runtime = FakeRuntime()
+    return runtime.bus, SignalRouter(runtime, **PROPERTIES_CHANGED)
+
+def test_daemon_only_delivers_subscribed_interfaces():
+    bus, router = make_router()
+    calls = []
+    for interface in ("org.bluez.Device1", "org.bluez.MediaPlayer1"):
+        router.subscribe(lambda *args: calls.append(args), arg0=interface)
+
+    assert bus.arg0s() == ["org.bluez.Device1", "org.bluez.MediaPlayer1"]
+    assert bus.emit("/org/bluez/hci0/dev_1", "org.bluez.GattCharacteristic1", {"Value": b"x"}, []) == 0
+    assert bus.emit("/org/bluez/hci0/dev_1", "org.bluez.Device1", {"RSSI": -40}, []) == 1
+    assert calls == [("org.bluez.Device1", {"RSSI": -40}, [], "/org/bluez/hci0/dev_1")]
+
+def test_catch_all_replaces_filtered_rules():
+    bus, router = make_router()
+    router.subscribe(lambda *args: None, arg0="org.bluez.Device1")
+    subscription = router.subscribe(lambda *args: None)
+    assert bus.arg0s() == ["None"]
+
+    # Back to filtered rules once nobody wants everything
+    subscription.remove()
+    assert bus.arg0s() == ["org.bluez.Device1"]
+
+def test_handlers_for_one_interface_share_a_rule():
+    bus, router = make_router()
+    calls = []
+    router.subscribe(lambda *args: calls.append("mirror"), arg0="org.bluez.MediaTransport1")
+    router.subscribe(lambda *args: calls.append("volume"), arg0="org.bluez.MediaTransport1")
+
+    assert bus.emit("/org/bluez/hci0/dev_1/fd0", "org.bluez.MediaTransport1", {"Volume": 50}, []) == 1
+    assert calls == ["mirror", "volume"]
+
+def test_path_namespace():
+    bus, router = make_router()
+    calls = []
+    router.subscribe(lambda *args: calls.append(args[-1]), arg0="org.bluez.MediaPlayer1", pathNamespace="/org/bluez/hci0/dev_1")
+
+    bus.emit("/org/bluez/hci0/dev_1/player0", "org.bluez.MediaPlayer1", {}, [])
+    bus.emit("/org/bluez/hci0/dev_10/player0", "org.bluez.MediaPlayer1", {}, [])
+    assert calls == ["/org/bluez/hci0/dev_1/player0"]
+
+def test_failing_handler_does_not_stop_the_others():
+    bus, router = make_router()
+    calls = []
+    router.subscribe(lambda *args: 1 / 0, arg0="org.bluez.Device1")
+    router.subscribe(lambda *args: calls.append(args), arg0="org.bluez.Device1")
+
+    bus.emit("/org/bluez/hci0/dev_1", "org.bluez.Device1", {}, [])
+    assert len(calls) == 1
+    assert router.stats()["dispatched"] == 2
@@ -0,0 +1,55 @@
+import logging
+from types import SimpleNamespace
+
+import pytest
+
+# VolumeControlThread is a DBusThread, so the module needs dbus-python even though no bus is used here
+pytest.importorskip("dbus")
+
+from threads.volume_control import VolumeControlThread
+from threads.handler_queue import merge_properties
+
+TRANSPORT = "/org/bluez/hci0/dev_AA_BB_CC_DD_EE_FF/fd0"
+INTERFACE = "org.bluez.MediaTransport1"
+ADDRESS = "AA:BB:CC:DD:EE:FF"
+
+# Just enough of a VolumeControlThread to run its property handler, without a bus or an audio server
+class HandlerOnly(VolumeControlThread):
+    bluezObjects = None # Set per test instead of the shared mirror
+
+def make_thread(mirrorVolume=None):
+    thread = HandlerOnly.__new__(HandlerOnly)
+    thread.logger = logging.getLogger("test_volume_control")
+    thread.transports = {TRANSPORT: {"name": "Phone", "address": ADDRESS, "codec": 0}}
+    thread.bluezObjects = SimpleNamespace(get_property=lambda path, interface, prop: mirrorVolume)
+    thread.submitted = []
+    thread.volumeCoalescer = SimpleNamespace(submit=lambda address, volume: thread.submitted.append((address, volume)))
+    return thread
+
+def merged(*changes):
+    events = [(INTERFACE, changed, [], TRANSPORT) for changed in changes]
+    result = events[0]
+    for event in events[1:]:
+        result = merge_properties(result, event)
+    return result
+
+def test_volume_survives_being_merged_with_a_state_change():
+    thread = make_thread()
+    thread.device_property_changed(*merged({"State": "idle"}, {"Volume": 50}))
+    assert thread.submitted == [(ADDRESS, 50)]
+
+def test_every_merged_property_is_applied():
+    thread = make_thread()
+    thread.device_property_changed(*merged({"Codec": 2}, {"State": "active"}, {"Volume": 90}))
+    assert thread.transports[TRANSPORT]["codec"] == 2
+    assert thread.submitted == [(ADDRESS, 90)]
+
+def test_active_without_volume_uses_the_mirror():
+    thread = make_thread(mirrorVolume=64)
+    thread.device_property_changed(*merged({"State": "active"}))
+    assert thread.submitted == [(ADDRESS, 64)]
+
+def test_idle_without_volume_sets_nothing():
+    thread = make_thread(mirrorVolume=64)
+    thread.device_property_changed(*merged({"State": "idle"}))
+    assert thread.submitted == []
@@ -0,0 +1,96 @@
+import threading, queue
+from concurrent.futures import Future
+
+# Looks up album art on a background thread so DBus callbacks never wait on the network
+# Lookups for the current track replace older ones, anything still waiting for a track that's no longer playing is cancelled
+class AlbumArtWorker:
+    MAX_QUEUE = 8
+
+    lookupFunc = None # Run with (trackInfo) on the worker thread, returns the art link or None
+    logger = None
+
+    requests = None # Bounded queue of (generation, trackInfo, future, callback)
+    generation = 0 # Increased every time the current track changes
+    lock = None
+    workerThread = None
+    running = False
+
+    def __init__(self, lookupFunc, logger, maxQueue=MAX_QUEUE):
+        self.lookupFunc = lookupFunc
+        self.logger = logger
+        self.requests = queue.Queue(maxQueue)
+        self.lock = threading.Lock()
+
+        self.running = True
+        self.workerThread = threading.Thread(target=self.run)
+        self.workerThread.daemon = True
+        self.workerThread.start()
+
+    # Queues a lookup and returns a future for its result
+    # callback is run with (trackInfo, link) on the worker thread, but only if the lookup is still current when it finishes
+    def submit(self, trackInfo, callback=None) -> Future:
+        future = Future()
+
+        with self.lock:
+            self.generation += 1
+            generation = self.generation
+
+            # Queue is full, make room by dropping the oldest request
+            while True:
+                try:
+                    self.requests.put_nowait((generation, trackInfo, future, callback))
+                    break
+                except queue.Full:
+                    try:
+                        self.requests.get_nowait()[2].cancel()
+                    except queue.Empty:
+                        pass
+
+        return future
+
+    # Whether a request was made for a track that's no longer the current one
+    def is_stale(self, generation) -> bool:
+        return generation is not None and generation != self.generation
+
+    def run(self):
+        while self.running:
+            generation, trackInfo, future, callback = self.requests.get()
+
+            if not self.running:
+                future.cancel()
+                break
+            if self.is_stale(generation):
+                future.cancel()
+                continue
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                link = self.lookupFunc(trackInfo)
+            except Exception as e:
+                self.logger.error("Error when looking up album art: " + str(e))
+                future.set_exception(e)
+                continue
+
+            future.set_result(link)
+
+            # Track changed while we were looking, the result isn't wanted on screen anymore
+            if self.is_stale(generation):
+                self.logger.debug("Discarding album art for a track that's no longer playing")
+                continue
+
+            if callable(callback):
+                try:
+                    callback(trackInfo, link)
+                except Exception as e:
+                    self.logger.error("Error in album art callback: " + str(e))
+
+    def stop(self):
+        self.running = False
+        with self.lock:
+            self.generation += 1
+        # Wake the worker up so it can exit
+        try:
+            self.requests.put_nowait((None, None, Future(), None))
+        except queue.Full:
+            pass
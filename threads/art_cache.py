@@ -0,0 +1,205 @@
+import os, json, hashlib, tempfile, threading, logging
+from collections import OrderedDict
+
+# Turns artist and album into the key used by the caches, so small differences in formatting still match
+def normalize_key(artist, album) -> str:
+    def normalize(value):
+        return " ".join(str(value or "").casefold().split())
+
+    return normalize(artist) + "\x00" + normalize(album)
+
+# Key of one size of an album's art, None is whatever size was stored without one
+def art_key(artist, album, size=None) -> str:
+    key = normalize_key(artist, album)
+    return key if size is None else f"{key}@{size}"
+
+# Writes a file so readers only ever see the old or the new contents, never half of it
+def atomic_write(path, data: bytes):
+    directory = os.path.dirname(path)
+    fd, tmpPath = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmpPath, path)
+    except Exception:
+        os.unlink(tmpPath)
+        raise
+
+# Content-addressed album art cache on a writable path (tmpfs or a data partition, the root FS is read-only)
+# Images are stored by the SHA-256 of their bytes, and an index maps (artist, album) to them
+# Least recently used entries are evicted when there are too many or they take too much space
+# The most recent images are also kept in memory for the current session, and if the path isn't writable that's all there is
+class AlbumArtCache:
+    INDEX_NAME = "index.json"
+    MAX_BYTES = 50 * 1024 * 1024
+    MAX_ENTRIES = 2000
+    MEMORY_ENTRIES = 16
+
+    directory = None
+    maxBytes = MAX_BYTES
+    maxEntries = MAX_ENTRIES
+    logger = None
+
+    index = None # OrderedDict of {key: {"hash", "ext", "size"}}, least recently used first
+    memory = None # OrderedDict of {hash: bytes}, least recently used first
+    memoryEntries = MEMORY_ENTRIES
+    lock = None
+    writable = False
+
+    def __init__(self, directory, maxBytes=MAX_BYTES, maxEntries=MAX_ENTRIES, memoryEntries=MEMORY_ENTRIES, logger=None):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.maxEntries = maxEntries
+        self.memoryEntries = memoryEntries
+        self.logger = logger or logging.getLogger("AlbumArtCache")
+        self.index = OrderedDict()
+        self.memory = OrderedDict()
+        self.lock = threading.RLock()
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            self.writable = os.access(self.directory, os.W_OK)
+        except OSError as e:
+            self.logger.warning(f"Album art cache directory {self.directory} can't be used: {e}")
+
+        if not self.writable:
+            self.logger.warning("Album art will only be cached in memory")
+            return
+
+        self.load_index()
+
+    def load_index(self):
+        try:
+            with open(os.path.join(self.directory, self.INDEX_NAME)) as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Album art cache index is unreadable, starting fresh: {e}")
+            return
+
+        # Stored least recently used first, only keep entries whose files are still there
+        for key, entry in entries:
+            if os.path.exists(self.file_path(entry["hash"], entry["ext"])):
+                self.index[key] = entry
+
+    def save_index(self):
+        if not self.writable:
+            return
+        data = json.dumps(list(self.index.items())).encode()
+        atomic_write(os.path.join(self.directory, self.INDEX_NAME), data)
+
+    def file_path(self, digest, ext):
+        return os.path.join(self.directory, f"{digest}.{ext}")
+
+    # Where an image can be found, its file path, or only its file name when it's just in memory
+    # Either way the name is the content hash, which is all /art needs to serve it
+    def location(self, digest, ext):
+        return self.file_path(digest, ext) if self.writable else f"{digest}.{ext}"
+
+    # Location of the cached image for an album (see location()), or None if it isn't cached
+    def get_path(self, artist, album, size=None):
+        key = art_key(artist, album, size)
+        with self.lock:
+            entry = self.index.get(key)
+            if entry is None:
+                return None
+
+            # Memory first, without a writable path it's the only place the image can be
+            if entry["hash"] in self.memory:
+                self.memory.move_to_end(entry["hash"])
+            elif not self.writable:
+                del self.index[key]
+                return None
+
+            self.index.move_to_end(key)
+            return self.location(entry["hash"], entry["ext"])
+
+    # Hash the image is stored under, or None if it isn't cached
+    def get_hash(self, artist, album, size=None):
+        with self.lock:
+            entry = self.index.get(art_key(artist, album, size))
+            return entry["hash"] if entry else None
+
+    # Image bytes by content hash, served from memory when possible
+    def get_bytes(self, digest):
+        with self.lock:
+            data = self.memory.get(digest)
+            if data is not None:
+                self.memory.move_to_end(digest)
+                return data
+
+            entry = next((entry for entry in self.index.values() if entry["hash"] == digest), None)
+            if entry is None:
+                return None
+
+        try:
+            with open(self.file_path(digest, entry["ext"]), "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+
+        self.remember(digest, data)
+        return data
+
+    # Stores an image for an album, returns its location (see location()), or None if it couldn't be kept
+    # size tells apart thumbnails of the same album made for different displays
+    def put(self, artist, album, data: bytes, ext="jpg", size=None):
+        digest = hashlib.sha256(data).hexdigest()
+        key = art_key(artist, album, size)
+        self.remember(digest, data)
+
+        with self.lock:
+            self.index[key] = {"hash": digest, "ext": ext, "size": len(data)}
+            self.index.move_to_end(key)
+
+            if not self.writable:
+                # Forget albums whose images have been pushed out of memory
+                for oldKey in [k for k, entry in self.index.items() if entry["hash"] not in self.memory]:
+                    del self.index[oldKey]
+                return self.location(digest, ext)
+
+            path = self.file_path(digest, ext)
+            try:
+                # Same image may already be stored for another album
+                if not os.path.exists(path):
+                    atomic_write(path, data)
+                self.evict()
+                self.save_index()
+            except OSError as e:
+                self.logger.warning(f"Couldn't write album art to cache: {e}")
+                self.index.pop(key, None)
+                return None
+
+            # Image was too big to fit in the cache at all
+            if key not in self.index:
+                return None
+
+            return path
+
+    def remember(self, digest, data):
+        with self.lock:
+            self.memory[digest] = data
+            self.memory.move_to_end(digest)
+            while len(self.memory) > self.memoryEntries:
+                self.memory.popitem(last=False)
+
+    # Drops least recently used entries until the cache fits its limits, should be called with the lock held
+    def evict(self):
+        # Files can be shared by several entries, only count them once
+        sizes = {entry["hash"]: entry["size"] for entry in self.index.values()}
+        totalBytes = sum(sizes.values())
+
+        while self.index and (len(self.index) > self.maxEntries or totalBytes > self.maxBytes):
+            key, entry = self.index.popitem(last=False)
+
+            # Only delete the file once no other entry uses it
+            if any(other["hash"] == entry["hash"] for other in self.index.values()):
+                continue
+
+            totalBytes -= entry["size"]
+            self.memory.pop(entry["hash"], None)
+            try:
+                os.unlink(self.file_path(entry["hash"], entry["ext"]))
+            except OSError:
+                pass
@@ -0,0 +1,65 @@
+import io
+
+# Pillow is optional, without it images are stored as downloaded
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+MAX_DOWNLOAD_BYTES = 2 * 1024 * 1024
+CHUNK_SIZE = 16 * 1024
+THUMBNAIL_QUALITY = 85
+
+# Deezer cover links by their width in pixels, smallest first
+DEEZER_COVERS = [(56, "cover_small"), (250, "cover_medium"), (500, "cover_big"), (1000, "cover_xl")]
+
+# Picks the smallest Deezer cover that's still at least `size` pixels wide, so we never download more than we show
+def pick_cover_link(album, size) -> str:
+    for width, field in DEEZER_COVERS:
+        if width >= size and album.get(field):
+            return album[field]
+    # Nothing big enough, use the biggest one there is
+    for width, field in reversed(DEEZER_COVERS):
+        if album.get(field):
+            return album[field]
+    return ""
+
+# Downloads an image in chunks, giving up if it's bigger than maxBytes
+def download_image(client, url, maxBytes=MAX_DOWNLOAD_BYTES) -> bytes:
+    with client.get(url, stream=True) as response:
+        response.raise_for_status()
+
+        length = response.headers.get("Content-Length")
+        if length and int(length) > maxBytes:
+            raise ValueError(f"Image is {length} bytes, more than the {maxBytes} byte limit")
+
+        data = bytearray()
+        for chunk in response.iter_content(CHUNK_SIZE):
+            data += chunk
+            if len(data) > maxBytes:
+                raise ValueError(f"Image is more than the {maxBytes} byte limit")
+
+    return bytes(data)
+
+# Decodes an image once and shrinks it to fit in each size x size square as a compact JPEG
+# Returns {size: bytes}, the original bytes are used if Pillow isn't installed or can't read them
+def make_thumbnails(data: bytes, sizes, quality=THUMBNAIL_QUALITY):
+    if Image is None:
+        return {size: data for size in sizes}
+
+    thumbnails = {}
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            img = img.convert("RGB")
+
+            # Largest first, so each smaller one is resized from an already smaller image
+            for size in sorted(sizes, reverse=True):
+                img.thumbnail((size, size), Image.LANCZOS)
+
+                out = io.BytesIO()
+                img.save(out, "JPEG", quality=quality, optimize=True, progressive=True)
+                thumbnails[size] = out.getvalue()
+    except (OSError, ValueError):
+        return {size: data for size in sizes}
+
+    return thumbnails
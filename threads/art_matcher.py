@@ -0,0 +1,91 @@
+import re, unicodedata
+from difflib import SequenceMatcher
+
+# Bracketed or dashed suffixes that don't change which album art it is, e.g. "(Remastered 2011)" or "- Deluxe Edition"
+# Whole words only, so "(Deep Cuts)" or "- Alive" aren't taken for an "ep" or "live" suffix
+EDITION_WORDS = r"\b(?:remaster(?:ed)?|deluxe|edition|expanded|anniversary|bonus|version|explicit|clean|mono|stereo|live|single|ep)\b"
+BRACKETS_RE = re.compile(r"[\(\[][^\)\]]*(" + EDITION_WORDS + r")[^\)\]]*[\)\]]", re.IGNORECASE)
+DASH_SUFFIX_RE = re.compile(r"\s+-\s+[^-]*(" + EDITION_WORDS + r").*$", re.IGNORECASE)
+
+# Featured artists, either in the artist field or tacked onto a title
+FEATURING_RE = re.compile(r"[\(\[]?\s*\b(feat\.?|ft\.?|featuring|with)\s+[^\)\]]*[\)\]]?", re.IGNORECASE)
+ARTIST_SPLIT_RE = re.compile(r"\s*(?:,|&|\band\b|\bx\b|\+|/|;)\s*", re.IGNORECASE)
+NON_WORD_RE = re.compile(r"[^\w\s]")
+
+ARTIST_MIN = 0.7 # Below this it's a different artist, however close the album title is
+ARTIST_WEIGHT = 0.5
+ALBUM_WEIGHT = 0.4
+TRACK_WEIGHT = 0.1
+THRESHOLD = 0.75 # With a perfect artist match, the album still has to be fairly close
+
+# Lowercases, strips accents, punctuation and edition suffixes, so "Beyoncé - Lemonade (Deluxe)" matches "beyonce lemonade"
+def normalize(value) -> str:
+    value = str(value or "")
+    value = BRACKETS_RE.sub(" ", value)
+    value = DASH_SUFFIX_RE.sub("", value)
+    value = unicodedata.normalize("NFKD", value)
+    value = "".join(c for c in value if not unicodedata.combining(c))
+    value = NON_WORD_RE.sub(" ", value.casefold())
+    return " ".join(value.split())
+
+# Each artist credited, with featured artists split off, normalized
+def split_artists(value) -> list:
+    value = str(value or "")
+    main = FEATURING_RE.sub(" ", value)
+    featured = [match.group(0) for match in FEATURING_RE.finditer(value)]
+    names = ARTIST_SPLIT_RE.split(main)
+    for feat in featured:
+        names += ARTIST_SPLIT_RE.split(re.sub(r"^[\(\[]?\s*\b(feat\.?|ft\.?|featuring|with)\s+", "", feat, flags=re.IGNORECASE).rstrip(")]"))
+    return [name for name in (normalize(name) for name in names) if name]
+
+# 0 to 1, how alike two already normalized strings are
+def similarity(a: str, b: str) -> float:
+    if not a or not b:
+        return 0.0
+    if a == b:
+        return 1.0
+
+    # Word overlap handles reordering, the sequence ratio handles typos and small differences
+    aWords, bWords = set(a.split()), set(b.split())
+    overlap = len(aWords & bWords) / len(aWords | bWords)
+    return max(overlap, SequenceMatcher(None, a, b).ratio())
+
+# How alike the credits are, as whole strings or by their primary artists
+# Other credits don't count on their own, otherwise "Sons" would be a perfect match for "Mumford & Sons"
+def artist_similarity(trackArtist, candidateArtist) -> float:
+    trackArtists = split_artists(trackArtist)
+    candidateArtists = split_artists(candidateArtist)
+    if not trackArtists or not candidateArtists:
+        return 0.0
+
+    # Whole credit as one string catches artists whose names contain "&" or "and"
+    # Primary artists catch featured and extra credits on one side only, e.g. "Post Malone, Swae Lee" on a Post Malone album
+    return max(
+        similarity(normalize(trackArtist), normalize(candidateArtist)),
+        similarity(trackArtists[0], candidateArtists[0])
+    )
+
+# Scores a Deezer album search result against the track that's playing
+def score_candidate(candidate, trackInfo) -> float:
+    artistScore = artist_similarity(trackInfo.get("Artist", ""), (candidate.get("artist") or {}).get("name", ""))
+    if artistScore < ARTIST_MIN:
+        return 0.0
+    albumScore = similarity(normalize(trackInfo.get("Album", "")), normalize(candidate.get("title", "")))
+
+    # Album results don't have a track title, only count it when the candidate has one
+    candidateTrack = (candidate.get("track") or {}).get("title")
+    if candidateTrack:
+        trackScore = similarity(normalize(trackInfo.get("Title", "")), normalize(candidateTrack))
+        return ARTIST_WEIGHT * artistScore + ALBUM_WEIGHT * albumScore + TRACK_WEIGHT * trackScore
+
+    return (ARTIST_WEIGHT * artistScore + ALBUM_WEIGHT * albumScore) / (ARTIST_WEIGHT + ALBUM_WEIGHT)
+
+# Returns the highest scoring candidate, or None if none reach the threshold
+def best_match(candidates, trackInfo, threshold=THRESHOLD):
+    best, bestScore = None, threshold
+    for candidate in candidates:
+        score = score_candidate(candidate, trackInfo)
+        # Ties keep the earlier candidate, Deezer already ranks by relevance
+        if score > bestScore or (best is None and score == bestScore):
+            best, bestScore = candidate, score
+    return best
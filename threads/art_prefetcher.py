@@ -0,0 +1,107 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import dbus
+
+from threads.art_image import MAX_DOWNLOAD_BYTES
+
+# Warms the album art cache for the tracks coming up next, read from the phone's now playing list over AVRCP browsing
+# Only works when the phone supports browsing (MediaFolder1 on the player, and a Playlist), otherwise it does nothing
+# Each track change starts a new round with its own budget of fetches and bytes, leftovers from the last round are cancelled
+class ArtPrefetcher:
+    DEPTH = 3 # Upcoming tracks to prefetch
+    MAX_CONCURRENT = 2
+    MAX_BYTES = 3 * MAX_DOWNLOAD_BYTES # Most bytes a single round may download
+
+    pct = None # PlaybackControlThread, used for the bus and album art lookups
+    logger = None
+    depth = DEPTH
+    maxBytes = MAX_BYTES
+
+    executor = None
+    lock = None
+    round = 0
+    remainingBytes = 0
+    futures = None
+
+    def __init__(self, pct, logger, depth=DEPTH, maxConcurrent=MAX_CONCURRENT, maxBytes=MAX_BYTES):
+        self.pct = pct
+        self.logger = logger
+        self.depth = depth
+        self.maxBytes = maxBytes
+        self.executor = ThreadPoolExecutor(max_workers=maxConcurrent, thread_name_prefix="ArtPrefetcher")
+        self.lock = threading.Lock()
+        self.futures = []
+
+    # Called when the track changes, never blocks the caller
+    def track_changed(self, trackInfo):
+        if self.depth <= 0:
+            return
+
+        with self.lock:
+            self.round += 1
+            self.remainingBytes = self.maxBytes
+            for future in self.futures:
+                future.cancel()
+            self.futures = [self.executor.submit(self.plan, self.round, trackInfo)]
+
+    # Finds the upcoming tracks and queues a fetch for each, runs on the executor since listing items is a bus call
+    def plan(self, round, trackInfo):
+        try:
+            tracks = self.upcoming_tracks(trackInfo)
+        except Exception as e:
+            # Nobody waits on this future, so the error would go unnoticed otherwise
+            self.logger.error("Error when finding upcoming tracks: " + str(e))
+            return
+
+        for upcoming in tracks:
+            with self.lock:
+                if round != self.round:
+                    return
+                self.futures.append(self.executor.submit(self.fetch, round, upcoming))
+
+    def fetch(self, round, trackInfo):
+        artist, album = trackInfo.get("Artist", ""), trackInfo.get("Album", "")
+        if not artist or not album or self.pct.albumArtCache.get_path(artist, album, self.pct.albumArtSizes[0]):
+            # Nothing to look up or already cached
+            return
+
+        # Reserve the most this download may use up front, so the round can't go over its budget
+        with self.lock:
+            if round != self.round or self.remainingBytes <= 0:
+                return
+            reserved = min(MAX_DOWNLOAD_BYTES, self.remainingBytes)
+            self.remainingBytes -= reserved
+
+        self.logger.debug(f"Prefetching album art for {album} by {artist}")
+        self.pct.getAlbumArt(trackInfo, maxBytes=reserved)
+
+    # Metadata of the next `depth` tracks after the current one, empty if the phone doesn't support browsing
+    def upcoming_tracks(self, trackInfo):
+        objects = self.pct.bluezObjects
+        playlistPath = objects.get_property(self.pct.playerPath, "org.bluez.MediaPlayer1", "Playlist")
+        if not playlistPath:
+            return []
+
+        # BlueZ puts MediaFolder1 on the player, the playlist is a MediaItem1 the player's folder is changed to
+        try:
+            folder = self.pct.get_interface("org.bluez", self.pct.playerPath, "org.bluez.MediaFolder1")
+            folder.ChangeFolder(playlistPath)
+            items = folder.ListItems(dbus.Dictionary({}, signature="sv"))
+        except dbus.exceptions.DBusException as e:
+            self.logger.debug("Couldn't list now playing items: " + str(e))
+            return []
+
+        # Items come back as {item path: properties}, in playlist order
+        # Newer BlueZ puts the track info in Metadata, older versions put it on the item itself
+        tracks = [props.get("Metadata", props) for path, props in items.items()]
+
+        for i, track in enumerate(tracks):
+            if all(track.get(key, "") == trackInfo.get(key, "") for key in ["Title", "Artist", "Album"]):
+                return tracks[i + 1:i + 1 + self.depth]
+
+        # Don't know where we are in the list, so we don't know what's next either
+        return []
+
+    def stop(self):
+        self.executor.shutdown(wait=False)
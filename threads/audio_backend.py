@@ -0,0 +1,288 @@
+import subprocess, threading, time
+from abc import ABC, abstractmethod
+
+# Native PulseAudio connection is optional, falls back to running pactl
+try:
+    import pulsectl
+except ImportError:
+    pulsectl = None
+
+# Name prefixes of bluetooth A2DP sources, PulseAudio uses the first one and PipeWire the second
+SOURCE_PREFIXES = ("bluez_source.", "bluez_input.")
+
+# Returns the part of a source name that identifies the device, AA:BB:CC:DD:EE:FF -> AA_BB_CC_DD_EE_FF
+def address_to_source_key(address: str) -> str:
+    return address.replace(':', '_')
+
+def is_source_for(name: str, address: str) -> bool:
+    return name.startswith(SOURCE_PREFIXES) and address_to_source_key(address) in name
+
+# Volume as a fraction of PA_VOLUME_NORM for a linear amplitude factor, the same as pa_sw_volume_from_linear
+# That's what pactl does with a decimal volume, so both backends make the phone's volume sound the same
+def linear_to_volume(linear: float) -> float:
+    return linear ** (1 / 3) if linear > 0 else 0.0
+
+# Controls source volumes on the audio server
+# Subclasses keep an address -> source mapping that's invalidated when sources come and go
+class AudioBackend(ABC):
+    logger = None
+    sources = None # {address: source index}
+    lock = None
+
+    def __init__(self, logger):
+        self.logger = logger
+        self.sources = {}
+        self.lock = threading.Lock()
+
+    # Given a bluetooth address in format AA:BB:CC:DD:EE:FF, fetch the index number to the audio source
+    def address_to_index(self, address: str):
+        with self.lock:
+            if address in self.sources:
+                return self.sources[address]
+
+        index = self.find_source(address)
+
+        if index is None:
+            self.logger.debug(u"Cannot find A2DP source {}".format(address))
+            return None
+
+        with self.lock:
+            self.sources[address] = index
+        self.logger.debug(u"A2DP source {} is #{}".format(address, index))
+        return index
+
+    # Sets the volume of the source for a bluetooth address, volume is a fraction from 0 to 1
+    # Returns whether a source was found
+    def set_source_volume(self, address: str, volume: float) -> bool:
+        index = self.address_to_index(address)
+        if index is None:
+            return False
+
+        try:
+            self.set_index_volume(index, volume)
+        except Exception as e:
+            # Source probably went away without us hearing about it, look it up again next time
+            self.logger.warning(u"Could not set volume of source #{}: {}".format(index, e))
+            self.invalidate()
+            return False
+
+        return True
+
+    # Forgets all cached sources, run when sources are added or removed
+    def invalidate(self):
+        with self.lock:
+            self.sources.clear()
+
+    # Index of the source for a bluetooth address, or None if there isn't one
+    @abstractmethod
+    def find_source(self, address: str):
+        pass
+
+    # Volume is a linear amplitude factor from 0 to 1
+    @abstractmethod
+    def set_index_volume(self, index, volume: float):
+        pass
+
+    def close(self):
+        pass
+
+# Uses one long-lived native connection to PulseAudio (or pipewire-pulse) through pulsectl
+# A second connection listens for source events on its own thread
+# Both reconnect on their own if the server restarts, backing off from RECONNECT_MIN up to RECONNECT_MAX seconds
+class PulseBackend(AudioBackend):
+    CLIENT_NAME = "car-dashboard"
+    RECONNECT_MIN = 1
+    RECONNECT_MAX = 30
+
+    server = None
+    pulse = None # None while disconnected
+    pulseLock = None
+    reconnectDelay = RECONNECT_MIN
+    nextReconnect = 0 # time.monotonic() before which reconnecting isn't tried again
+    channels = None # {source index: channel count}
+    eventThread = None
+    eventPulse = None
+    stopEvent = None
+    closed = False
+
+    # server is a PulseAudio server string, None uses the default one
+    # The first connection has to work, create_backend falls back to pactl otherwise
+    def __init__(self, logger, server=None):
+        super().__init__(logger)
+        self.server = server
+        self.channels = {}
+        self.pulse = pulsectl.Pulse(self.CLIENT_NAME, server=server)
+        self.pulseLock = threading.Lock() # pulsectl connections aren't thread safe
+        self.reconnectDelay = self.RECONNECT_MIN
+        self.stopEvent = threading.Event()
+
+        self.eventPulse = pulsectl.Pulse(self.CLIENT_NAME + "-events", server=server)
+        self.eventThread = threading.Thread(target=self.listen_events)
+        self.eventThread.daemon = True
+        self.eventThread.start()
+
+    # Runs func with the connection, reconnecting first if it was lost, should be called with pulseLock held
+    # A failed call drops the connection, the next one makes a fresh one
+    def call(self, func):
+        if self.pulse is None:
+            if time.monotonic() < self.nextReconnect:
+                raise ConnectionError("Not connected to PulseAudio")
+            try:
+                self.pulse = pulsectl.Pulse(self.CLIENT_NAME, server=self.server)
+            except Exception:
+                self.nextReconnect = time.monotonic() + self.reconnectDelay
+                self.reconnectDelay = min(self.reconnectDelay * 2, self.RECONNECT_MAX)
+                raise
+            self.reconnectDelay = self.RECONNECT_MIN
+            self.logger.info("Reconnected to PulseAudio")
+            # Source indexes don't survive a server restart
+            self.invalidate()
+
+        try:
+            return func(self.pulse)
+        except Exception:
+            try:
+                self.pulse.close()
+            except Exception:
+                pass
+            self.pulse = None
+            raise
+
+    def find_source(self, address: str):
+        try:
+            with self.pulseLock:
+                sourceList = self.call(lambda pulse: pulse.source_list())
+        except Exception as e:
+            self.logger.warning(u"Could not list sources: {}".format(e))
+            return None
+
+        for source in sourceList:
+            if is_source_for(source.name, address):
+                with self.lock:
+                    self.channels[source.index] = len(source.volume.values)
+                return source.index
+        return None
+
+    def set_index_volume(self, index, volume: float):
+        with self.lock:
+            channels = self.channels.get(index, 2)
+
+        volumeInfo = pulsectl.PulseVolumeInfo(linear_to_volume(volume), channels)
+        with self.pulseLock:
+            self.call(lambda pulse: pulse.source_volume_set(index, volumeInfo))
+
+    def listen_events(self):
+        def on_event(event):
+            if event.t in ("new", "remove"):
+                self.invalidate()
+            if self.closed:
+                raise pulsectl.PulseLoopStop
+
+        delay = None
+        while not self.closed:
+            try:
+                if self.eventPulse is None:
+                    self.eventPulse = pulsectl.Pulse(self.CLIENT_NAME + "-events", server=self.server)
+                    # Sources may have come and gone while nobody was listening
+                    self.invalidate()
+                    self.logger.info("Listening for PulseAudio events again")
+                delay = None
+
+                self.eventPulse.event_mask_set("source")
+                self.eventPulse.event_callback_set(on_event)
+                self.eventPulse.event_listen()
+                error = "connection closed"
+            except Exception as e:
+                error = e
+            if self.closed:
+                return
+
+            # Only stops listening on its own when the server goes away
+            delay = self.RECONNECT_MIN if delay is None else min(delay * 2, self.RECONNECT_MAX)
+            self.logger.warning(u"Lost PulseAudio events ({}), reconnecting in {}s".format(error, delay))
+            try:
+                if self.eventPulse is not None:
+                    self.eventPulse.close()
+            except Exception:
+                pass
+            self.eventPulse = None
+            self.stopEvent.wait(delay)
+
+    def invalidate(self):
+        with self.lock:
+            self.sources.clear()
+            self.channels.clear()
+
+    def close(self):
+        self.closed = True
+        self.stopEvent.set()
+        eventPulse = self.eventPulse
+        if eventPulse is not None:
+            eventPulse.event_listen_stop()
+        with self.pulseLock:
+            if self.pulse is not None:
+                self.pulse.close()
+
+# Fallback that runs pactl, sources are still cached and a long-running `pactl subscribe` invalidates them
+class SubprocessBackend(AudioBackend):
+    subscribeProcess = None
+    subscribeThread = None
+
+    def __init__(self, logger):
+        super().__init__(logger)
+
+        try:
+            self.subscribeProcess = subprocess.Popen(
+                ["pactl", "subscribe"],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                universal_newlines=True
+            )
+        except OSError as e:
+            # Without events the cache is only reset when setting the volume fails
+            self.logger.warning(u"Could not subscribe to source events: {}".format(e))
+            return
+
+        self.subscribeThread = threading.Thread(target=self.listen_events)
+        self.subscribeThread.daemon = True
+        self.subscribeThread.start()
+
+    def find_source(self, address: str):
+        try:
+            result = subprocess.run(["pactl", "list", "short", "sources"], stdout=subprocess.PIPE, universal_newlines=True)
+        except OSError as e:
+            self.logger.warning(u"Could not list sources: {}".format(e))
+            return None
+
+        # Source index is first field and name is second field in tab separated lines
+        for line in result.stdout.splitlines():
+            fields = line.split("\t")
+            if len(fields) > 1 and is_source_for(fields[1], address):
+                return fields[0]
+        return None
+
+    # pactl takes a decimal volume as a linear factor itself
+    def set_index_volume(self, index, volume: float):
+        subprocess.run(["pactl", "set-source-volume", str(index), format(volume, '.2f')], check=True)
+
+    # Lines look like: Event 'new' on source #12
+    def listen_events(self):
+        for line in self.subscribeProcess.stdout:
+            if "on source #" in line and ("'new'" in line or "'remove'" in line):
+                self.invalidate()
+
+    def close(self):
+        if self.subscribeProcess:
+            self.subscribeProcess.terminate()
+
+# Picks the best backend that works on this system
+def create_backend(logger):
+    if pulsectl is not None:
+        try:
+            backend = PulseBackend(logger)
+            logger.info("Using native PulseAudio connection for volume control")
+            return backend
+        except Exception as e:
+            logger.warning(u"Could not connect to PulseAudio natively, falling back to pactl: {}".format(e))
+
+    return SubprocessBackend(logger)
@@ -2,12 +2,13 @@ from threads.dbus_thread import DBusThread
 import os, sys, logging, subprocess
 import dbus
 import threading
-from time import sleep
 
 # Constants
 SERVICE_NAME = "org.bluez"
 ADAPTER_INTERFACE = SERVICE_NAME + ".Adapter1"
 DEVICE_INTERFACE = SERVICE_NAME + ".Device1"
+PLAYER_INTERFACE = SERVICE_NAME + ".MediaPlayer1"
+TRANSPORT_INTERFACE = SERVICE_NAME + ".MediaTransport1"
 
 BUS_NAME = 'org.bluez'
 AGENT_INTERFACE = 'org.bluez.Agent1'
@@ -31,12 +32,10 @@ class BluetoothControlThread(DBusThread):
         self.obj = self.sysBus.get_object(SERVICE_NAME, "/org/bluez");
         self.manager = dbus.Interface(self.obj, "org.bluez.AgentManager1")
 
-        # Turn on power
-        self.find_adapter_in_objects(self.get_managed_objects()).Powered = True
-
-        # Pairable and discoverable
-        self.find_adapter_in_objects(self.get_managed_objects()).Pairable = True
-        self.find_adapter_in_objects(self.get_managed_objects()).Discoverable = True
+        # Turn on power, then make it pairable and discoverable
+        adapterProps = self.get_interface(SERVICE_NAME, self.bluezObjects.find_adapter(), "org.freedesktop.DBus.Properties")
+        for prop in ["Powered", "Pairable", "Discoverable"]:
+            adapterProps.Set(ADAPTER_INTERFACE, prop, dbus.Boolean(True))
 
         # Register agent
         self.manager.RegisterAgent(AGENT_PATH, CAPABILITY)
@@ -51,81 +50,181 @@ class BluetoothControlThread(DBusThread):
         # Start mainloop
         super().runMainLoop()
     
-    def wait_for_connection(self):
-        starting = self.get_all_connected()
-        addrs = [device["addr"] for device in starting]
-        
-        # Wait for device to connect
-        while True:
-            curr = self.get_all_connected()
-            if len(curr) == 1:
-                self.logger.info(f"{curr[0]['name']} is connecting...")
-
-                # Check if it was paired before
-                wasPairedBefore = False
-                for i, dic in enumerate(curr):
-                    if dic["addr"] in addrs:
-                        wasPairedBefore = True
-                        break
-
-                # If not paired, wait for a service authorization before continuing
-                if not wasPairedBefore:
-                    self.logger.debug("Device is being paired, waiting for authorization before continuing...")
-                    while True:
-                        if self.agent.auth_count > 0:
-                            self.logger.info("At least 1 service has been authorized!")
-                            break
-                        self.logger.info("Waiting...")
-                        sleep(1.5)
-                
-                # Wait 1 second for services to authorize (takes less time but better to be safe since relying on time)
-                sleep(1)
-
-                # Should be connected
-                self.logger.info(f"{curr[0]['name']} has connected!")
-                
-                # Make device undiscoverable so others can't connect
-                subprocess.run("/home/pi/carDashboard/makeUndiscoverable", stdout=subprocess.PIPE)
-                break
-            else:
-                self.logger.info("Waiting for connection...")
-            sleep(1)
+    # Blocks until a device is connected and ready, returns its info or None if the timeout ran out
+    # Driven by DBus signals instead of polling, timeout is in seconds (None waits forever)
+    def wait_for_connection(self, timeout=None):
+        ready = threading.Event()
+        lock = threading.Lock()
+        devices = {} # Device1 properties of every known device, keyed by path
+        alreadyConnected = set() # Addresses of devices connected before we started waiting
+        readyPath = []
+
+        # Checks whether a device can be used yet, should be called with the lock held
+        def check_ready(path):
+            props = devices.get(path)
+            if ready.is_set() or not props or not props.get("Connected", False):
+                return
+
+            # Don't consider the device ready until BlueZ has finished resolving its services
+            if not props.get("ServicesResolved", True):
+                self.logger.info(f"{props.get('Name', path)} is connecting...")
+                return
+
+            # If not paired before, wait for a service authorization before continuing
+            # Trusted devices get their services authorized by BlueZ without asking the agent
+            if str(props.get("Address", "")) not in alreadyConnected and \
+                    not props.get("Trusted", False) and path not in self.agent.authorized:
+                self.logger.debug("Device is being paired, waiting for authorization before continuing...")
+                return
+
+            readyPath.append(path)
+            ready.set()
+
+        def interfaces_added(path, interfaces):
+            if DEVICE_INTERFACE not in interfaces:
+                return
+            with lock:
+                devices[path] = dict(interfaces[DEVICE_INTERFACE])
+                check_ready(path)
+
+        def properties_changed(interface, changed, invalidated, path):
+            with lock:
+                devices.setdefault(path, {}).update(changed)
+                check_ready(path)
+
+        def service_authorized(path):
+            self.logger.info("At least 1 service has been authorized!")
+            with lock:
+                check_ready(path)
+
+        # Listen before taking the snapshot so nothing can slip through in between
+        receivers = [
+            self.add_signal_receiver(
+                interfaces_added,
+                bus_name=SERVICE_NAME,
+                signal_name="InterfacesAdded",
+                dbus_interface="org.freedesktop.DBus.ObjectManager"
+            ),
+            self.subscribe_properties(properties_changed, DEVICE_INTERFACE)
+        ]
+        self.agent.authorizeCallback = service_authorized
+
+        with lock:
+            for path, interfaces in self.get_managed_objects().items():
+                if DEVICE_INTERFACE in interfaces:
+                    # Signals may have already come in, those are newer than the snapshot
+                    devices[path] = {**interfaces[DEVICE_INTERFACE], **devices.get(path, {})}
+
+            # Devices that are already connected were paired before
+            alreadyConnected.update(str(props.get("Address", "")) for props in devices.values() if props.get("Connected", False))
+            for path in list(devices.keys()):
+                check_ready(path)
+
+        self.logger.info("Waiting for connection...")
+        ready.wait(timeout)
+
+        # Stop listening, the signals aren't needed anymore
+        for receiver in receivers:
+            receiver.remove()
+        self.agent.authorizeCallback = None
+
+        if not ready.is_set():
+            self.logger.warning(f"No device connected within {timeout} seconds")
+            return None
+
+        with lock:
+            path = readyPath[0]
+            props = devices[path]
+
+        # Should be connected
+        self.logger.info(f"{props.get('Name', path)} has connected!")
+
+        # Make device undiscoverable so others can't connect
+        subprocess.run("/home/pi/carDashboard/makeUndiscoverable", stdout=subprocess.PIPE)
+
+        return {
+            "obj": self.get_interface(SERVICE_NAME, path, DEVICE_INTERFACE),
+            "path": path,
+            "name": str(props.get("Name", "")),
+            "addr": str(props.get("Address", "")),
+            "paired": bool(props.get("Paired", False)),
+            "connected": bool(props.get("Connected", False))
+        }
+
+    # Blocks until the device has a media player and a media transport, which the playback and volume threads need
+    # Phones add them a moment after connecting, driven by InterfacesAdded instead of a fixed sleep
+    # Returns whether both showed up before the timeout (in seconds, None waits forever)
+    def wait_for_media(self, devicePath, timeout=None):
+        ready = threading.Event()
+        lock = threading.Lock()
+        found = set() # Media interfaces seen on the device
+
+        # Should be called with the lock held
+        def check_ready():
+            if PLAYER_INTERFACE in found and TRANSPORT_INTERFACE in found:
+                ready.set()
+
+        def interfaces_added(path, interfaces):
+            with lock:
+                for interface in (PLAYER_INTERFACE, TRANSPORT_INTERFACE):
+                    if interface in interfaces and str(interfaces[interface].get("Device", "")) == devicePath:
+                        found.add(interface)
+                check_ready()
+
+        # Listen before checking the mirror so nothing can slip through in between
+        receiver = self.add_signal_receiver(
+            interfaces_added,
+            bus_name=SERVICE_NAME,
+            signal_name="InterfacesAdded",
+            dbus_interface="org.freedesktop.DBus.ObjectManager"
+        )
+
+        with lock:
+            for interface in (PLAYER_INTERFACE, TRANSPORT_INTERFACE):
+                if self.bluezObjects.find_paths(interface, devicePath):
+                    found.add(interface)
+            check_ready()
+
+        if not ready.is_set():
+            self.logger.info("Waiting for the media player and transport...")
+        ready.wait(timeout)
+        receiver.remove()
+
+        if not ready.is_set():
+            self.logger.warning(f"Media player or transport didn't show up within {timeout} seconds")
+        return ready.is_set()
     
     # Util functions
-    def get_all_connected(self):
-        interface_name = "org.bluez.Device1"
-        objects = self.get_managed_objects()
+    # Filters on Connected using the object mirror, so disconnected devices never cost a bus call
+    # If refresh is set, each connected device is re-read from BlueZ with a single GetAll
+    def get_all_connected(self, refresh=False):
         results = []
 
-        for path in objects.keys():
-            interfaces = objects[path]
-            for interface in interfaces.keys():
-                if interface == interface_name:
-                    results.append(path)
-
-        real_result = []
-
-        for result in results:
-            obj = self.sysBus.get_object('org.bluez', result)
-            iface = dbus.Interface(obj, "org.freedesktop.DBus.Properties")
-            real_result.append({
-                "obj": dbus.Interface(obj, "org.bluez.Device1"),
-                "name": str(iface.Get("org.bluez.Device1", "Name")),
-                "addr": str(iface.Get("org.bluez.Device1", "Address")),
-                "paired": bool(iface.Get("org.bluez.Device1", "Paired")),
-                "connected": bool(iface.Get("org.bluez.Device1", "Connected"))
+        for path, props in self.bluezObjects.find_objects(DEVICE_INTERFACE).items():
+            if not props.get("Connected", False):
+                continue
+
+            if refresh:
+                props = self.get_interface(SERVICE_NAME, path, "org.freedesktop.DBus.Properties").GetAll(DEVICE_INTERFACE)
+                if not props.get("Connected", False):
+                    continue
+
+            results.append({
+                "obj": self.get_interface(SERVICE_NAME, path, DEVICE_INTERFACE),
+                "name": str(props.get("Name", "")),
+                "addr": str(props.get("Address", "")),
+                "paired": bool(props.get("Paired", False)),
+                "connected": bool(props.get("Connected", False))
             })
         
-        real_result = [result for result in real_result if result["connected"]]
-        return real_result
+        return results
     
+    # Served from the shared object mirror, doesn't touch the bus
     def get_managed_objects(self):
-        manager = dbus.Interface(self.sysBus.get_object("org.bluez", "/"),
-                    "org.freedesktop.DBus.ObjectManager")
-        return manager.GetManagedObjects()
+        return self.bluezObjects.get_managed_objects()
 
     def find_adapter(self, pattern=None):
-        return self.find_adapter_in_objects(get_managed_objects(), pattern)
+        return self.find_adapter_in_objects(self.get_managed_objects(), pattern)
 
     def find_adapter_in_objects(self, objects, pattern=None):
         for path, ifaces in objects.items():
@@ -134,8 +233,7 @@ class BluetoothControlThread(DBusThread):
                 continue
             if not pattern or pattern == adapter["Address"] or \
                                 path.endswith(pattern):
-                obj = self.sysBus.get_object(SERVICE_NAME, path)
-                return dbus.Interface(obj, ADAPTER_INTERFACE)
+                return self.get_interface(SERVICE_NAME, path, ADAPTER_INTERFACE)
         raise Exception("Bluetooth adapter not found")
 
     def find_device(self, device_address, adapter_pattern=None):
@@ -145,7 +243,7 @@ class BluetoothControlThread(DBusThread):
     def find_device_in_objects(self, objects, device_address, adapter_pattern=None):
         path_prefix = ""
         if adapter_pattern:
-            adapter = find_adapter_in_objects(objects, adapter_pattern)
+            adapter = self.find_adapter_in_objects(objects, adapter_pattern)
             path_prefix = adapter.object_path
         for path, ifaces in objects.items():
             device = ifaces.get(DEVICE_INTERFACE)
@@ -153,8 +251,7 @@ class BluetoothControlThread(DBusThread):
                 continue
             if (device["Address"] == device_address and
                             path.startswith(path_prefix)):
-                obj = self.sysBus.get_object(SERVICE_NAME, path)
-                return dbus.Interface(obj, DEVICE_INTERFACE)
+                return self.get_interface(SERVICE_NAME, path, DEVICE_INTERFACE)
 
         raise Exception("Bluetooth device not found")
 
@@ -176,18 +273,24 @@ class BluetoothControlThread(DBusThread):
         self.mainLoop.quit()
 
     def set_trusted(self, path):
-        props = dbus.Interface(self.sysBus.get_object("org.bluez", path),
-                        "org.freedesktop.DBus.Properties")
+        props = self.get_interface("org.bluez", path, "org.freedesktop.DBus.Properties")
         props.Set("org.bluez.Device1", "Trusted", True)
 
     def dev_connect(self, path):
-        dev = dbus.Interface(self.sysBus.get_object("org.bluez", path),
-                                "org.bluez.Device1")
+        dev = self.get_interface("org.bluez", path, "org.bluez.Device1")
         dev.Connect()
 
 class BluetoothAgent(dbus.service.Object):
     exit_on_release = True
     auth_count = 0
+    authorized = None # Paths of devices that have had at least 1 service authorized
+
+    # Run with the device path whenever a service gets authorized
+    authorizeCallback = None
+
+    def __init__(self, conn, object_path):
+        super().__init__(conn, object_path)
+        self.authorized = set()
 
     def set_exit_on_release(self, exit_on_release):
         self.exit_on_release = exit_on_release
@@ -196,6 +299,10 @@ class BluetoothAgent(dbus.service.Object):
     def AuthorizeService(self, device, uuid):
         print("AuthorizeService (%s, %s)" % (device, uuid))
         self.auth_count += 1
+        self.authorized.add(str(device))
+
+        if callable(self.authorizeCallback):
+            self.authorizeCallback(str(device))
         return
 
     @dbus.service.method(AGENT_INTERFACE, in_signature="o", out_signature="")
@@ -0,0 +1,202 @@
+import threading, logging
+
+import dbus
+
+from threads.dbus_runtime import DBusRuntime
+
+# Constants
+SERVICE_NAME = "org.bluez"
+ADAPTER_INTERFACE = SERVICE_NAME + ".Adapter1"
+DEVICE_INTERFACE = SERVICE_NAME + ".Device1"
+OBJECT_MANAGER_INTERFACE = "org.freedesktop.DBus.ObjectManager"
+PROPERTIES_INTERFACE = "org.freedesktop.DBus.Properties"
+
+# Interfaces whose property changes the mirror follows, everything else keeps the values it was loaded or added with
+# Each gets its own arg0 match, so the daemon drops changes nobody reads (GATT notifications, Battery1, ...) instead of waking us
+MIRRORED_INTERFACES = [
+    ADAPTER_INTERFACE,
+    DEVICE_INTERFACE,
+    SERVICE_NAME + ".MediaPlayer1",
+    SERVICE_NAME + ".MediaTransport1",
+    SERVICE_NAME + ".MediaFolder1"
+]
+
+# In-process mirror of the BlueZ object tree
+# Loaded once with GetManagedObjects and then kept current with signals, so lookups never touch the bus
+class BluezObjectCache:
+    _instance = None
+    _instanceLock = threading.Lock()
+
+    bus = None
+    objects = None # {path: {interface: {property: value}}}
+    lock = None
+    receivers = None
+    logger = None
+
+    # Returns the mirror shared by every thread, creating it on first use
+    @classmethod
+    def get_instance(cls, bus):
+        with cls._instanceLock:
+            if cls._instance is None:
+                cls._instance = cls(bus)
+            return cls._instance
+
+    def __init__(self, bus):
+        self.bus = bus
+        self.objects = {}
+        self.lock = threading.RLock()
+        self.logger = logging.getLogger("BluezObjectCache")
+
+        # Listen before loading so no change can be missed in between
+        router = DBusRuntime.get_instance().properties_router(SERVICE_NAME)
+        self.receivers = [
+            DBusRuntime.get_instance().add_signal_receiver(
+                self._interfaces_added,
+                bus_name=SERVICE_NAME,
+                signal_name="InterfacesAdded",
+                dbus_interface=OBJECT_MANAGER_INTERFACE
+            ),
+            DBusRuntime.get_instance().add_signal_receiver(
+                self._interfaces_removed,
+                bus_name=SERVICE_NAME,
+                signal_name="InterfacesRemoved",
+                dbus_interface=OBJECT_MANAGER_INTERFACE
+            ),
+            # BlueZ doesn't send InterfacesRemoved when it crashes or restarts, its owner changing is the only sign
+            DBusRuntime.get_instance().add_signal_receiver(
+                self._name_owner_changed,
+                bus_name="org.freedesktop.DBus",
+                signal_name="NameOwnerChanged",
+                dbus_interface="org.freedesktop.DBus",
+                arg0=SERVICE_NAME
+            )
+        ] + [
+            router.subscribe(self._properties_changed, arg0=interface, name="BluezObjectCache._properties_changed")
+            for interface in MIRRORED_INTERFACES
+        ]
+
+        self.refresh()
+
+    # Reloads the whole tree from BlueZ, done at startup and whenever BlueZ restarts
+    def refresh(self):
+        manager = dbus.Interface(self.bus.get_object(SERVICE_NAME, "/"), OBJECT_MANAGER_INTERFACE)
+        managed = manager.GetManagedObjects()
+
+        with self.lock:
+            self.objects = {
+                str(path): {str(iface): dict(props) for iface, props in interfaces.items()}
+                for path, interfaces in managed.items()
+            }
+
+    def close(self):
+        for receiver in self.receivers:
+            receiver.remove()
+        self.receivers = []
+
+    # Signal handlers
+    # Runs on the dispatcher thread, so the reload is ordered with the InterfacesAdded that come after it
+    def _name_owner_changed(self, name, oldOwner, newOwner):
+        if not newOwner:
+            self.logger.warning("BlueZ left the bus, clearing the object mirror")
+            with self.lock:
+                self.objects = {}
+            return
+
+        self.logger.info("BlueZ (re)started, reloading the object mirror")
+        try:
+            self.refresh()
+        except dbus.exceptions.DBusException as e:
+            # Objects it adds once it's up still come in through InterfacesAdded
+            self.logger.error("Unable to reload the object mirror: " + str(e))
+            with self.lock:
+                self.objects = {}
+
+    def _interfaces_added(self, path, interfaces):
+        with self.lock:
+            entry = self.objects.setdefault(str(path), {})
+            for iface, props in interfaces.items():
+                entry[str(iface)] = dict(props)
+
+    def _interfaces_removed(self, path, interfaces):
+        with self.lock:
+            entry = self.objects.get(str(path))
+            if entry is None:
+                return
+
+            for iface in interfaces:
+                entry.pop(str(iface), None)
+
+            if not entry:
+                del self.objects[str(path)]
+
+    def _properties_changed(self, interface, changed, invalidated, path):
+        with self.lock:
+            entry = self.objects.get(str(path))
+            if entry is None:
+                return
+
+            props = entry.setdefault(str(interface), {})
+            props.update(changed)
+            for prop in invalidated:
+                props.pop(str(prop), None)
+
+    # Lookups, all return copies so callers can't change the mirror by accident
+    def get_managed_objects(self):
+        with self.lock:
+            return {
+                path: {iface: dict(props) for iface, props in interfaces.items()}
+                for path, interfaces in self.objects.items()
+            }
+
+    def get_interfaces(self, path):
+        with self.lock:
+            return list(self.objects.get(str(path), {}).keys())
+
+    # Properties of an interface on an object, None if the object doesn't have it
+    def get_properties(self, path, interface):
+        with self.lock:
+            props = self.objects.get(str(path), {}).get(interface)
+            return dict(props) if props is not None else None
+
+    def get_property(self, path, interface, prop, default=None):
+        with self.lock:
+            return self.objects.get(str(path), {}).get(interface, {}).get(prop, default)
+
+    # Every object with the given interface as {path: properties}
+    # If devicePath is given, only objects belonging to that device (players, transports, ...) are returned
+    def find_objects(self, interface, devicePath=None):
+        with self.lock:
+            results = {}
+            for path, interfaces in self.objects.items():
+                props = interfaces.get(interface)
+                if props is None:
+                    continue
+                if devicePath and path != devicePath and str(props.get("Device", "")) != devicePath:
+                    continue
+                results[path] = dict(props)
+            return results
+
+    def find_paths(self, interface, devicePath=None):
+        return list(self.find_objects(interface, devicePath).keys())
+
+    def find_adapter(self, pattern=None):
+        with self.lock:
+            for path, interfaces in self.objects.items():
+                adapter = interfaces.get(ADAPTER_INTERFACE)
+                if adapter is None:
+                    continue
+                if not pattern or pattern == adapter.get("Address") or path.endswith(pattern):
+                    return path
+        raise Exception("Bluetooth adapter not found")
+
+    def find_device(self, address, adapter_pattern=None):
+        path_prefix = self.find_adapter(adapter_pattern) if adapter_pattern else ""
+
+        with self.lock:
+            for path, interfaces in self.objects.items():
+                device = interfaces.get(DEVICE_INTERFACE)
+                if device is None:
+                    continue
+                if device.get("Address") == address and path.startswith(path_prefix):
+                    return path
+        raise Exception("Bluetooth device not found")
@@ -1,4 +1,6 @@
 from threads.dbus_thread import DBusThread
+from threads.proxy_pool import ProxyPool
+from threads.playback_state import playbackState
 import os, sys, logging
 
 import dbus
@@ -47,11 +49,11 @@ class VoiceCallHandlerThread(DBusThread):
         # Add callbacks
         self._ofonoVCM.connect_to_signal(
             "CallAdded",
-            self.handleCallAdd
+            self.runtime.timed(self.queued(self.handleCallAdd), "VoiceCallHandlerThread.handleCallAdd")
         )
         self._ofonoVCM.connect_to_signal(
             "CallRemoved",
-            self.handleCallRemove
+            self.runtime.timed(self.queued(self.handleCallRemove), "VoiceCallHandlerThread.handleCallRemove")
         )
 
         # Fetch any current calls, also check if vcm obj exists
@@ -83,10 +85,11 @@ class VoiceCallHandlerThread(DBusThread):
         self.logger.debug(f"Call added: {path} - {properties}")
 
         # Get the VoiceCall object and add it to the list
+        callInterface = self.get_interface("org.ofono", path, "org.ofono.VoiceCall")
         voiceCallObj = {
             "path": path, # Path to call
-            "object": dbus.Interface(self.sysBus.get_object(f"org.ofono", path), 'org.ofono.VoiceCall'), # Interface to call, properties always updated
-            "staticProps": dbus.Interface(self.sysBus.get_object(f"org.ofono", path), 'org.ofono.VoiceCall').GetProperties() # Properties of call when first started
+            "object": callInterface, # Interface to call, properties always updated
+            "staticProps": callInterface.GetProperties() # Properties of call when first started
         }
 
         self.calls.append(voiceCallObj)
@@ -95,12 +98,18 @@ class VoiceCallHandlerThread(DBusThread):
         def handleCallPropertyChange(prop, value):
             # Print property change
             self.logger.debug(f"Property '{prop}' in call '{path}' changed: {value}")
+
+            if prop == "State":
+                self.store_call(path, voiceCallObj["staticProps"], value)
             
             # Run extra callback
             if callable(self.handleCallPropertyChangeExtra):
                 self.handleCallPropertyChangeExtra(voiceCallObj, prop, value)
         
-        voiceCallObj["object"].connect_to_signal("PropertyChanged", handleCallPropertyChange)
+        voiceCallObj["object"].connect_to_signal(
+            "PropertyChanged",
+            self.runtime.timed(self.queued(handleCallPropertyChange), "VoiceCallHandlerThread.handleCallPropertyChange")
+        )
 
         # Check if incoming, only useful for debug
         if properties["State"] == "incoming":
@@ -118,6 +127,8 @@ class VoiceCallHandlerThread(DBusThread):
             else:
                 self.logger.info(f"Dialing unknown number")
 
+        self.store_call(path, properties)
+
         # Run extra callback if we can
         if callable(self.handleCallAddExtra):
             self.handleCallAddExtra(voiceCallObj)
@@ -142,4 +153,22 @@ class VoiceCallHandlerThread(DBusThread):
         
         if callIndex != None:
             # Delete from list
-            del self.calls[callIndex]
\ No newline at end of file
+            del self.calls[callIndex]
+
+        # Call object is gone, so is its proxy
+        ProxyPool.get_instance(self.sysBus).invalidate_path(path)
+
+        # Show whichever call is left, if any
+        if self.calls:
+            self.store_call(self.calls[-1]["path"], self.calls[-1]["staticProps"])
+        else:
+            playbackState.update(call=None)
+
+    # Puts a call into the shared state store, state overrides the one in properties if given
+    def store_call(self, path, properties, state=None):
+        playbackState.update(call={
+            "path": str(path),
+            "state": str(state if state is not None else properties.get("State", "")),
+            "name": str(properties.get("Name", "")),
+            "number": str(properties.get("LineIdentification", ""))
+        })
\ No newline at end of file
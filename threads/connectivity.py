@@ -0,0 +1,122 @@
+import socket, threading, time, logging
+
+# Opens a TCP connection to see if the internet is reachable, cheaper than a full HTTPS request
+def tcp_probe(host="www.google.com", port=443, timeout=3) -> bool:
+    try:
+        socket.create_connection((host, port), timeout=timeout).close()
+        return True
+    except OSError:
+        return False
+
+# Keeps track of whether the internet is reachable in the background, so callers never wait on a probe
+# While online it probes every `interval` seconds, while offline it backs off exponentially from minBackoff up to maxBackoff
+# Backoff only goes back down once a real request succeeds (report_success) or we stay online for a whole interval,
+# so a probe that gets through while the services we need don't can't make us retry them in a tight loop
+class ConnectivityMonitor:
+    INTERVAL = 60
+    MIN_BACKOFF = 5
+    MAX_BACKOFF = 300
+
+    probeFunc = None # Returns whether the network is reachable, can be replaced with a fake one
+    interval = INTERVAL
+    minBackoff = MIN_BACKOFF
+    maxBackoff = MAX_BACKOFF
+    logger = None
+
+    online = False # Assume offline until the first probe says otherwise
+    backoff = MIN_BACKOFF
+    nextProbe = 0 # time.monotonic() of the next probe
+    lock = None
+    listeners = None # Run with (online) whenever the state changes
+    wakeEvent = None
+    monitorThread = None
+    running = False
+
+    def __init__(self, logger=None, probeFunc=tcp_probe, interval=INTERVAL, minBackoff=MIN_BACKOFF, maxBackoff=MAX_BACKOFF):
+        self.logger = logger or logging.getLogger("ConnectivityMonitor")
+        self.probeFunc = probeFunc
+        self.interval = interval
+        self.minBackoff = minBackoff
+        self.maxBackoff = maxBackoff
+        self.backoff = minBackoff
+        self.listeners = []
+        self.lock = threading.Lock()
+        self.wakeEvent = threading.Event()
+
+        self.running = True
+        self.monitorThread = threading.Thread(target=self.run)
+        self.monitorThread.daemon = True
+        self.monitorThread.start()
+
+    # Cached state, never blocks
+    def is_online(self) -> bool:
+        return self.online
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    # Lets callers that hit a network error mark us offline right away, instead of waiting for the next probe
+    # The next probe waits out the backoff, which grows with every failure until something succeeds
+    def report_failure(self):
+        with self.lock:
+            self.schedule_backoff()
+        self.set_online(False)
+        # Wake the monitor so it waits for the new probe time instead of the rest of the online interval
+        self.wakeEvent.set()
+
+    def report_success(self):
+        with self.lock:
+            self.backoff = self.minBackoff
+        self.set_online(True)
+
+    # Probe now instead of waiting out the interval or backoff
+    def check_now(self):
+        with self.lock:
+            self.nextProbe = 0
+        self.wakeEvent.set()
+
+    # Puts the next probe one backoff from now and doubles the backoff, should be called with the lock held
+    def schedule_backoff(self):
+        self.nextProbe = time.monotonic() + self.backoff
+        self.backoff = min(self.backoff * 2, self.maxBackoff)
+
+    def set_online(self, online):
+        if online == self.online:
+            return
+        self.online = online
+
+        self.logger.info("Internet connection " + ("found" if online else "lost"))
+        for listener in list(self.listeners):
+            try:
+                listener(online)
+            except Exception as e:
+                self.logger.error("Error in connectivity listener: " + str(e))
+
+    def run(self):
+        while self.running:
+            with self.lock:
+                delay = self.nextProbe - time.monotonic()
+            if delay > 0:
+                self.wakeEvent.wait(delay)
+                self.wakeEvent.clear()
+                continue
+
+            try:
+                online = bool(self.probeFunc())
+            except Exception:
+                online = False
+
+            with self.lock:
+                if online:
+                    # Still online a whole interval after the last probe, the connection can be trusted again
+                    if self.online:
+                        self.backoff = self.minBackoff
+                    self.nextProbe = time.monotonic() + self.interval
+                else:
+                    self.schedule_backoff()
+
+            self.set_online(online)
+
+    def stop(self):
+        self.running = False
+        self.wakeEvent.set()
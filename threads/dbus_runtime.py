@@ -0,0 +1,118 @@
+import threading, time, logging
+
+import dbus
+import dbus.mainloop.glib
+from gi.repository import GLib
+
+from threads.signal_router import SignalRouter
+from threads import metrics
+
+# The one system bus connection and GLib main loop the whole app shares
+# Components register their signal handlers here, they're all dispatched from a single loop thread
+# Each handler is timed, see handler_stats()
+# There's deliberately no asyncio (dbus-next) alternative: hot paths read the signal-fed BlueZ mirror instead of the bus,
+# the bulk reads left are one per connected device, and replies on a second connection aren't ordered with the signals
+# that keep the mirror current, so a reload there could roll back newer changes
+class DBusRuntime:
+    _instance = None
+    _instanceLock = threading.Lock()
+
+    bus = None
+    mainLoop = None
+    loopThread = None
+    logger = None
+
+    stats = None # {handler name: [calls, total seconds, max seconds]}
+    statsLock = None
+    routers = None # {bus name: SignalRouter for its PropertiesChanged}
+
+    # Returns the runtime shared by every component, connecting to the bus on first use
+    @classmethod
+    def get_instance(cls):
+        with cls._instanceLock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def __init__(self):
+        self.logger = logging.getLogger("DBusRuntime")
+        self.stats = {}
+        self.statsLock = threading.Lock()
+        self.routers = {}
+
+        dbus.mainloop.glib.threads_init()
+        dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+        self.bus = dbus.SystemBus()
+        self.mainLoop = GLib.MainLoop()
+
+    # Starts the dispatcher thread, does nothing if it's already running
+    def start(self):
+        with self._instanceLock:
+            if self.loopThread is not None and self.loopThread.is_alive():
+                return
+
+            self.loopThread = threading.Thread(target=self.mainLoop.run, name="DBusDispatcher")
+            self.loopThread.daemon = True
+            self.loopThread.start()
+
+        self.logger.info("Started DBus dispatcher thread")
+
+    def stop(self, timeout=5):
+        with self._instanceLock:
+            if self.loopThread is None:
+                return
+            self.mainLoop.quit()
+            loopThread, self.loopThread = self.loopThread, None
+
+        loopThread.join(timeout)
+        self.logger.info("Stopped DBus dispatcher thread")
+
+        for name, stats in sorted(self.handler_stats().items()):
+            self.logger.debug(f"{name}: {stats['calls']} calls, mean {stats['mean'] * 1000:.2f}ms, max {stats['max'] * 1000:.2f}ms")
+
+    def is_running(self) -> bool:
+        return self.loopThread is not None and self.loopThread.is_alive()
+
+    # Wraps a handler so every call to it is timed under `name`
+    def timed(self, handler, name=None):
+        name = name or getattr(handler, "__qualname__", repr(handler))
+
+        def timedHandler(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return handler(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                with self.statsLock:
+                    entry = self.stats.setdefault(name, [0, 0.0, 0.0])
+                    entry[0] += 1
+                    entry[1] += elapsed
+                    entry[2] = max(entry[2], elapsed)
+                if metrics.enabled:
+                    metrics.dbusDispatch.observe(elapsed, name)
+
+        return timedHandler
+
+    # Same as dbus.Bus.add_signal_receiver, but the handler is timed, returns the match so it can be removed
+    def add_signal_receiver(self, handler, name=None, **match):
+        return self.bus.add_signal_receiver(self.timed(handler, name), **match)
+
+    # Shared router for PropertiesChanged from a service, so each change is only unmarshalled once however many handlers want it
+    def properties_router(self, busName) -> SignalRouter:
+        with self._instanceLock:
+            if busName not in self.routers:
+                self.routers[busName] = SignalRouter(
+                    self,
+                    bus_name=busName,
+                    signal_name="PropertiesChanged",
+                    dbus_interface="org.freedesktop.DBus.Properties"
+                )
+            return self.routers[busName]
+
+    # Calls, total and max dispatch time of each handler, in seconds
+    def handler_stats(self):
+        with self.statsLock:
+            return {
+                name: {"calls": calls, "total": total, "max": maxTime, "mean": total / calls if calls else 0.0}
+                for name, (calls, total, maxTime) in self.stats.items()
+            }
@@ -1,9 +1,9 @@
-import os, sys, logging, threading
+import sys, logging
 
-import dbus
-import dbus.mainloop.glib
-import dbus.service
-from gi.repository import GObject
+from threads.dbus_runtime import DBusRuntime
+from threads.handler_queue import HandlerQueue, merge_properties
+from threads.bluez_objects import BluezObjectCache
+from threads.proxy_pool import ProxyPool
 
 # Parent class for all threads that use DBus
 class DBusThread:
@@ -13,10 +13,16 @@ class DBusThread:
     LOG_FORMAT = "%(name)s[%(process)d]: %(message)s"
     logger = None
 
-    mainLoopThread = None
-
+    runtime = None # Bus connection and main loop shared by every thread
     sysBus = None
 
+    # Signal handlers run from this thread's own queue, see HandlerQueue for the policies
+    # Dropping the oldest never holds up the shared dispatcher, a backlog of QUEUE_SIZE events only builds up
+    # if a handler is stuck, and then the newest events are the ones worth keeping. Drops are logged and on /metrics
+    QUEUE_SIZE = HandlerQueue.MAX_SIZE
+    QUEUE_POLICY = HandlerQueue.DROP_OLDEST
+    handlerQueue = None
+
     def __init__(self, loggerName, logLevel):
         # Set all variables
         self.LOG_NAME = loggerName
@@ -32,25 +38,45 @@ class DBusThread:
         self.logger.addHandler(ch)
         self.logger.info('Started')
 
-        # Get the system bus
+        self.handlerQueue = HandlerQueue(self.LOG_NAME, self.logger, self.QUEUE_SIZE, self.QUEUE_POLICY)
+
+        # Get the system bus, shared with every other thread
         try:
-            dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
-            self.sysBus = dbus.SystemBus()
-            self.mainLoop = GObject.MainLoop()
+            self.runtime = DBusRuntime.get_instance()
+            self.sysBus = self.runtime.bus
             
         except Exception as ex:
             self.logger.error('Unable to get the system dbus: "{0}". Exiting. Is dbus running?'.format(str(ex)))
             sys.exit(1)
 
-    # Should be run after signal recievers are added
-    def runMainLoop(self):
-        # Runs DBus main loop
-        def mainloop():
-            GObject.MainLoop().run()
-        
-        self.mainLoopThread = threading.Thread(target=mainloop)
-        self.mainLoopThread.daemon = True
-        self.mainLoopThread.start()
+    # Mirror of the BlueZ object tree shared by all threads, loaded the first time it's needed
+    @property
+    def bluezObjects(self):
+        return BluezObjectCache.get_instance(self.sysBus)
 
-        self.logger.info("Started DBus main loop thread")
+    # Interface to a remote object, reused from the shared proxy pool when possible
+    def get_interface(self, busName, path, interface):
+        return ProxyPool.get_instance(self.sysBus).get_interface(busName, path, interface)
 
+    # Adds a signal handler to the shared bus, timed by the runtime under this thread's name
+    # The dispatcher only queues the call, the handler runs on this thread's handler queue
+    def add_signal_receiver(self, handler, **match):
+        return self.runtime.add_signal_receiver(self.queued(handler), name=f"{self.LOG_NAME}.{handler.__name__}", **match)
+
+    # Wraps a callback so it runs on this thread's handler queue, for signals connected some other way (connect_to_signal)
+    def queued(self, handler, keyFunc=None, merge=None):
+        return self.handlerQueue.wrap(handler, keyFunc, merge)
+
+    # Subscribes to PropertiesChanged through the shared router, handler gets (interface, changed, invalidated, path)
+    # interface and pathNamespace narrow what it's called for, the interface is also matched by the bus daemon
+    def subscribe_properties(self, handler, interface=None, pathNamespace=None, busName="org.bluez"):
+        # Changes to the same object queued up behind a slow handler are merged when the policy is COALESCE
+        return self.runtime.properties_router(busName).subscribe(
+            self.queued(handler, lambda interface, changed, invalidated, path: (interface, path), merge_properties),
+            arg0=interface, pathNamespace=pathNamespace, name=f"{self.LOG_NAME}.{handler.__name__}"
+        )
+
+    # Should be run after signal recievers are added
+    # Starts the shared dispatcher thread if no other thread has yet
+    def runMainLoop(self):
+        self.runtime.start()
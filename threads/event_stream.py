@@ -0,0 +1,86 @@
+import threading
+from collections import deque
+
+# Fans events out to any number of Server-Sent Events clients
+# The last few events are kept so a client that reconnects with Last-Event-ID gets what it missed
+class EventBroker:
+    HISTORY = 32
+    HEARTBEAT = 15 # Seconds between heartbeats when nothing happens, keeps proxies and kiosks from dropping the stream
+
+    history = None # deque of (id, event name, data)
+    lastId = 0
+    condition = None
+    heartbeat = HEARTBEAT
+    clients = 0
+    closed = False
+
+    def __init__(self, history=HISTORY, heartbeat=HEARTBEAT):
+        self.history = deque(maxlen=history)
+        self.heartbeat = heartbeat
+        self.condition = threading.Condition()
+
+    # Sends an event to every connected client, returns its id
+    def publish(self, data: str, event="update", eventId=None):
+        with self.condition:
+            self.lastId = eventId if eventId is not None else self.lastId + 1
+            self.history.append((self.lastId, event, data))
+            self.condition.notify_all()
+            return self.lastId
+
+    # Events after lastEventId, or just the latest one if the client is too far behind to catch up
+    def events_since(self, lastEventId):
+        if lastEventId is None:
+            return list(self.history)[-1:]
+
+        missed = [item for item in self.history if item[0] > lastEventId]
+        if missed and self.history[0][0] > lastEventId + 1:
+            # Some were already dropped from history, the latest one has the full state anyway
+            return missed[-1:]
+        return missed
+
+    @staticmethod
+    def format(eventId, event, data) -> str:
+        lines = "".join(f"data: {line}\n" for line in data.split("\n"))
+        return f"id: {eventId}\nevent: {event}\n{lines}\n"
+
+    # Generator of the SSE stream for one client, runs until the client goes away
+    def stream(self, lastEventId=None):
+        try:
+            lastEventId = int(lastEventId) if lastEventId not in (None, "") else None
+        except ValueError:
+            lastEventId = None
+
+        with self.condition:
+            self.clients += 1
+
+            # Ids from before a restart mean nothing now, start over from the latest state
+            if lastEventId is not None and lastEventId > self.lastId:
+                lastEventId = None
+            pending = self.events_since(lastEventId)
+            lastSeen = lastEventId if lastEventId is not None else self.lastId
+
+        try:
+            # Tell the browser how long to wait before reconnecting
+            yield "retry: 2000\n\n"
+
+            while not self.closed:
+                for eventId, event, data in pending:
+                    lastSeen = eventId
+                    yield self.format(eventId, event, data)
+
+                with self.condition:
+                    if self.lastId <= lastSeen and not self.closed:
+                        self.condition.wait(self.heartbeat)
+                    pending = self.events_since(lastSeen) if self.lastId > lastSeen else []
+
+                if not pending and not self.closed:
+                    yield ": heartbeat\n\n"
+        finally:
+            with self.condition:
+                self.clients -= 1
+
+    # Ends every client's stream, used when the server shuts down
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
@@ -0,0 +1,208 @@
+import threading, time, itertools
+from collections import OrderedDict
+
+from threads import metrics
+
+queues = {} # {name: HandlerQueue} of every running queue, read by the collectors below
+queuesLock = threading.Lock()
+
+# Reads one stat from every running queue, for the collectors
+def queue_stats(stat):
+    with queuesLock:
+        running = list(queues.values())
+    return {queue.name: queue.stats()[stat] for queue in running}
+
+metrics.collector("dashboard_handler_queue_depth", "Signal handler calls waiting in a component's queue", "gauge",
+    lambda: queue_stats("depth"), "queue")
+metrics.collector("dashboard_handler_queue_max_depth", "Most signal handler calls a component's queue has held at once", "gauge",
+    lambda: queue_stats("maxDepth"), "queue")
+metrics.collector("dashboard_handler_queue_dropped_total", "Signal handler calls dropped because a component's queue was full or stopped", "counter",
+    lambda: queue_stats("dropped"), "queue")
+metrics.collector("dashboard_handler_queue_coalesced_total", "Signal handler calls merged into one already queued", "counter",
+    lambda: queue_stats("coalesced"), "queue")
+
+# Merges two queued PropertiesChanged events (interface, changed, invalidated, path) into one
+# Newer values win, and a property is only left invalidated if it wasn't changed again after
+def merge_properties(old, new):
+    interface, oldChanged, oldInvalidated, path = old
+    _, newChanged, newInvalidated, _ = new
+
+    changed = {**oldChanged, **newChanged}
+    for prop in newInvalidated:
+        changed.pop(prop, None)
+    invalidated = [prop for prop in oldInvalidated if prop not in newChanged] + \
+        [prop for prop in newInvalidated if prop not in oldInvalidated]
+
+    return (interface, changed, invalidated, path)
+
+# Bounded queue of signal handler calls for one component, drained in order by its own worker thread
+# Signal callbacks only enqueue, so a slow handler only holds up its own component and never the DBus dispatcher
+# What happens when it's full depends on the policy:
+#   DROP_OLDEST drops the oldest queued event
+#   COALESCE merges an event into the queued one with the same key, and otherwise drops the oldest when full
+#   BLOCK makes the dispatcher wait for space, up to blockTimeout, then drops the new event
+#     The dispatcher is shared, so while it waits every other component's signals wait too
+class HandlerQueue:
+    DROP_OLDEST = "drop-oldest"
+    COALESCE = "coalesce"
+    BLOCK = "block"
+
+    MAX_SIZE = 64
+    BLOCK_TIMEOUT = 1 # Seconds
+    SLOW_HANDLER = 0.1 # Seconds a handler can take before it's logged as slow
+
+    name = None
+    logger = None
+    maxSize = MAX_SIZE
+    policy = DROP_OLDEST
+    blockTimeout = BLOCK_TIMEOUT
+    slowHandler = SLOW_HANDLER
+
+    events = None # OrderedDict of {key: (handler, args, kwargs, merge, time queued)}, oldest first
+    condition = None
+    workerThread = None
+    running = False
+    sequence = None # Keys for events that don't coalesce
+
+    # Counters, see stats()
+    received = 0
+    handled = 0
+    dropped = 0
+    coalesced = 0
+    slow = 0
+    maxDepth = 0
+    maxHandlerTime = 0
+
+    def __init__(self, name, logger, maxSize=MAX_SIZE, policy=DROP_OLDEST, blockTimeout=BLOCK_TIMEOUT, slowHandler=SLOW_HANDLER):
+        if policy not in (self.DROP_OLDEST, self.COALESCE, self.BLOCK):
+            raise ValueError(f"Unknown queue policy: {policy}")
+
+        self.name = name
+        self.logger = logger
+        self.maxSize = maxSize
+        self.policy = policy
+        self.blockTimeout = blockTimeout
+        self.slowHandler = slowHandler
+        self.events = OrderedDict()
+        self.condition = threading.Condition()
+        self.sequence = itertools.count()
+        self.running = True
+
+        with queuesLock:
+            queues[self.name] = self
+
+    # Queues handler(*args, **kwargs), called from signal callbacks
+    # With the COALESCE policy an event with the same key as a queued one is merged into it with merge(oldArgs, newArgs),
+    # or replaces it if merge isn't given, and keeps the queued one's place
+    def submit(self, handler, args=(), kwargs=None, key=None, merge=None):
+        with self.condition:
+            if not self.running:
+                return False
+            self.received += 1
+
+            if self.policy == self.COALESCE and key is not None:
+                key = ("key", key)
+                queued = self.events.get(key)
+                if queued is not None:
+                    # Keeps the time the first one was queued, the wait is measured from there
+                    self.events[key] = (handler, merge(queued[1], args) if merge else args, kwargs, merge, queued[4])
+                    self.coalesced += 1
+                    return True
+            else:
+                key = ("seq", next(self.sequence))
+
+            if len(self.events) >= self.maxSize:
+                if self.policy == self.BLOCK:
+                    if not self.condition.wait_for(lambda: len(self.events) < self.maxSize or not self.running, self.blockTimeout) \
+                            or not self.running:
+                        self.dropped += 1
+                        self.logger.warning(f"{self.name} queue still full after {self.blockTimeout}s, dropped an event")
+                        return False
+                else:
+                    self.events.popitem(last=False)
+                    self.dropped += 1
+                    self.logger.warning(f"{self.name} queue full, dropped the oldest event")
+
+            self.events[key] = (handler, args, kwargs, merge, time.perf_counter() if metrics.enabled else None)
+            self.maxDepth = max(self.maxDepth, len(self.events))
+            self.start_worker()
+            self.condition.notify_all()
+            return True
+
+    # Returns a callback that queues handler instead of running it, for add_signal_receiver and connect_to_signal
+    # keyFunc picks the coalescing key from the signal's arguments
+    def wrap(self, handler, keyFunc=None, merge=None):
+        def queuedHandler(*args, **kwargs):
+            self.submit(handler, args, kwargs or None, keyFunc(*args, **kwargs) if keyFunc else None, merge)
+        queuedHandler.__name__ = getattr(handler, "__name__", "queuedHandler")
+        return queuedHandler
+
+    # Worker is only started once there's something to do, components that never get signals don't cost a thread
+    # Should be called with the lock held
+    def start_worker(self):
+        if self.workerThread is None:
+            self.workerThread = threading.Thread(target=self.run, name=f"{self.name}Handlers")
+            self.workerThread.daemon = True
+            self.workerThread.start()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.events:
+                    self.condition.wait()
+                if not self.running:
+                    return
+
+                _, (handler, args, kwargs, _, queuedAt) = self.events.popitem(last=False)
+                # Room for anyone blocked in submit()
+                self.condition.notify_all()
+
+            start = time.perf_counter()
+            if queuedAt is not None:
+                metrics.queueWait.observe(start - queuedAt, self.name)
+
+            try:
+                handler(*args, **(kwargs or {}))
+            except Exception:
+                self.logger.exception(f"Error in {getattr(handler, '__name__', handler)}")
+            elapsed = time.perf_counter() - start
+            if metrics.enabled:
+                metrics.handlerRun.observe(elapsed, f"{self.name}.{getattr(handler, '__name__', 'handler')}")
+
+            with self.condition:
+                self.handled += 1
+                self.maxHandlerTime = max(self.maxHandlerTime, elapsed)
+                if elapsed > self.slowHandler:
+                    self.slow += 1
+
+            if elapsed > self.slowHandler:
+                self.logger.warning(f"Slow handler {getattr(handler, '__name__', handler)} took {elapsed * 1000:.0f}ms, {len(self.events)} events waiting")
+
+    def stats(self):
+        with self.condition:
+            return {
+                "policy": self.policy,
+                "depth": len(self.events),
+                "maxDepth": self.maxDepth,
+                "received": self.received,
+                "handled": self.handled,
+                "dropped": self.dropped,
+                "coalesced": self.coalesced,
+                "slow": self.slow,
+                "maxHandlerTime": self.maxHandlerTime
+            }
+
+    # Stops the worker, events still queued are dropped
+    def stop(self, timeout=5):
+        with self.condition:
+            self.running = False
+            self.dropped += len(self.events)
+            self.events.clear()
+            self.condition.notify_all()
+
+        with queuesLock:
+            if queues.get(self.name) is self:
+                del queues[self.name]
+
+        if self.workerThread is not None and self.workerThread is not threading.current_thread():
+            self.workerThread.join(timeout)
@@ -0,0 +1,72 @@
+import time, random, threading, logging
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Shared HTTP client for online lookups (album art and anything after it)
+# One pooled session keeps connections alive between tracks, so we don't pay for new TCP and TLS handshakes each time
+# Every request has a timeout, and connection errors, timeouts and 5xx responses are retried with jittered backoff
+class HttpClient:
+    USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/89.0.4389.114 Safari/537.36"
+    TIMEOUT = (3.05, 10) # Connect, read
+    MAX_HOSTS = 8 # Hosts with a pool kept open
+    MAX_PER_HOST = 2 # Open connections per host, further requests wait for one to be free
+    RETRIES = 2
+    BACKOFF = 0.5
+
+    session = None
+    timeout = TIMEOUT
+    retries = RETRIES
+    backoff = BACKOFF
+    logger = None
+
+    def __init__(self, timeout=TIMEOUT, retries=RETRIES, backoff=BACKOFF, maxHosts=MAX_HOSTS, maxPerHost=MAX_PER_HOST, logger=None):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.logger = logger or logging.getLogger("HttpClient")
+
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = self.USER_AGENT
+        adapter = HTTPAdapter(pool_connections=maxHosts, pool_maxsize=maxPerHost, pool_block=True)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+
+        attempt = 0
+        while True:
+            try:
+                response = self.session.request(method, url, **kwargs)
+                if response.status_code < 500 or attempt >= self.retries:
+                    return response
+                response.close()
+                reason = f"status {response.status_code}"
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.retries:
+                    raise
+                reason = str(e)
+
+            # Full jitter so retries from several lookups don't line up
+            delay = random.uniform(0, self.backoff * (2 ** attempt))
+            attempt += 1
+            self.logger.debug(f"Retrying {method} {url} in {delay:.2f}s ({reason})")
+            time.sleep(delay)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+_client = None
+_clientLock = threading.Lock()
+
+# Returns the client shared by everything that goes online
+def get_http_client() -> HttpClient:
+    global _client
+    with _clientLock:
+        if _client is None:
+            _client = HttpClient()
+        return _client
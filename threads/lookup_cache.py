@@ -0,0 +1,87 @@
+import json, time, threading, logging
+from collections import OrderedDict
+
+from threads.art_cache import normalize_key, atomic_write
+
+# Remembers the result of album art lookups, both the cover URL when one was found and the fact that none was
+# Entries expire after a TTL and are saved to disk so they survive restarts
+class AlbumLookupCache:
+    HIT_TTL = 30 * 24 * 60 * 60 # Cover URLs rarely change
+    MISS_TTL = 24 * 60 * 60 # Retry misses daily in case the catalog has caught up
+    MAX_ENTRIES = 5000
+
+    path = None
+    hitTtl = HIT_TTL
+    missTtl = MISS_TTL
+    maxEntries = MAX_ENTRIES
+    logger = None
+
+    entries = None # OrderedDict of {key: {"url", "expires"}}, oldest first, url is "" for a miss
+    lock = None
+
+    def __init__(self, path, hitTtl=HIT_TTL, missTtl=MISS_TTL, maxEntries=MAX_ENTRIES, logger=None):
+        self.path = path
+        self.hitTtl = hitTtl
+        self.missTtl = missTtl
+        self.maxEntries = maxEntries
+        self.logger = logger or logging.getLogger("AlbumLookupCache")
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Album lookup cache is unreadable, starting fresh: {e}")
+            return
+
+        now = time.time()
+        for key, entry in entries:
+            if entry["expires"] > now:
+                self.entries[key] = entry
+
+    def save(self):
+        try:
+            atomic_write(self.path, json.dumps(list(self.entries.items())).encode())
+        except OSError as e:
+            self.logger.warning(f"Couldn't save album lookup cache: {e}")
+
+    # Cover URL for an album, "" if it's known to have none, or None if it hasn't been looked up recently
+    def get(self, artist, album):
+        key = normalize_key(artist, album)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry["expires"] <= time.time():
+                del self.entries[key]
+                return None
+            return entry["url"]
+
+    def put_hit(self, artist, album, url):
+        self.put(artist, album, url, self.hitTtl)
+
+    def put_miss(self, artist, album):
+        self.put(artist, album, "", self.missTtl)
+
+    # Drops what's known about an album, so the next lookup searches again
+    def forget(self, artist, album):
+        with self.lock:
+            if self.entries.pop(normalize_key(artist, album), None) is not None:
+                self.save()
+
+    def put(self, artist, album, url, ttl):
+        key = normalize_key(artist, album)
+
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = {"url": url, "expires": time.time() + ttl}
+            while len(self.entries) > self.maxEntries:
+                self.entries.popitem(last=False)
+            self.save()
@@ -0,0 +1,173 @@
+import threading, functools
+from time import perf_counter
+from bisect import bisect_left
+
+# Latency histograms for the hot paths, served in Prometheus' text format on /metrics
+# Off by default, turned on with enable(), while off timers are a shared no-op and nothing is recorded
+# Counts components keep anyway (queue depths, volume updates) are read by collectors only when /metrics is scraped
+
+enabled = False
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10) # Seconds
+
+registry = {} # {metric name: Histogram or Collector}, in the order they were created
+registryLock = threading.Lock()
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+# Records how long the with block took into a histogram
+class Timer:
+    __slots__ = ("histogram", "labelValue", "start")
+
+    def __init__(self, histogram, labelValue):
+        self.histogram = histogram
+        self.labelValue = labelValue
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(perf_counter() - self.start, self.labelValue)
+        return False
+
+# What time() gives back while metrics are off
+class NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_TIMER = NullTimer()
+
+# Fixed bucket histogram, optionally split by one label (handler name, stage, ...)
+class Histogram:
+    name = None
+    help = None
+    label = None
+    buckets = BUCKETS
+    series = None # {label value: [bucket counts, sum, count]}
+    lock = None
+
+    def __init__(self, name, help, label=None, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, seconds, labelValue=""):
+        index = bisect_left(self.buckets, seconds)
+        with self.lock:
+            series = self.series.get(labelValue)
+            if series is None:
+                series = self.series[labelValue] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    # Context manager timing its block, free while metrics are off
+    def time(self, labelValue=""):
+        return Timer(self, labelValue) if enabled else NULL_TIMER
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+
+        with self.lock:
+            series = {labelValue: (list(counts), total, count) for labelValue, (counts, total, count) in self.series.items()}
+
+        for labelValue, (counts, total, count) in sorted(series.items()):
+            labels = f'{self.label}="{escape(labelValue)}"' if self.label else ""
+            separator = "," if labels else ""
+
+            cumulative = 0
+            for bound, bucketCount in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucketCount
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                lines.append(f'{self.name}_bucket{{{labels}{separator}le="{le}"}} {cumulative}')
+
+            labelSet = f"{{{labels}}}" if labels else ""
+            lines.append(f"{self.name}_sum{labelSet} {total}")
+            lines.append(f"{self.name}_count{labelSet} {count}")
+
+        return lines
+
+# Counter or gauge whose value is read from readFunc when rendered
+# readFunc returns a number, or {label value: number} if the collector has a label
+class Collector:
+    name = None
+    help = None
+    kind = None # "counter" or "gauge"
+    label = None
+    readFunc = None
+
+    def __init__(self, name, help, kind, readFunc, label=None):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.readFunc = readFunc
+        self.label = label
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+        values = self.readFunc()
+        if not self.label:
+            values = {"": values}
+
+        for labelValue, value in sorted(values.items()):
+            labelSet = f'{{{self.label}="{escape(labelValue)}"}}' if self.label else ""
+            lines.append(f"{self.name}{labelSet} {value}")
+
+        return lines
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+# Returns the histogram with that name, creating it the first time
+def histogram(name, help, label=None, buckets=BUCKETS) -> Histogram:
+    with registryLock:
+        if name not in registry:
+            registry[name] = Histogram(name, help, label, buckets)
+        return registry[name]
+
+# Registers a collector, replacing any earlier one with that name
+def collector(name, help, kind, readFunc, label=None) -> Collector:
+    with registryLock:
+        registry[name] = Collector(name, help, kind, readFunc, label)
+        return registry[name]
+
+# Decorator timing every call of a function, a single flag check while metrics are off
+def timed(histogram, labelValue=""):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(perf_counter() - start, labelValue)
+        return wrapper
+    return decorator
+
+# Every histogram in Prometheus' text exposition format
+def render() -> str:
+    with registryLock:
+        histograms = list(registry.values())
+    return "\n".join(line for h in histograms for line in h.render()) + "\n"
+
+# Histograms of the hot paths, from a signal arriving to the dashboard being updated
+dbusDispatch = histogram("dashboard_dbus_dispatch_seconds", "Time the DBus dispatcher spends on a signal callback", "handler")
+queueWait = histogram("dashboard_handler_queue_wait_seconds", "Time a signal waits in a component's handler queue", "queue")
+handlerRun = histogram("dashboard_handler_seconds", "Time a signal handler takes to run", "handler")
+albumArtStage = histogram("dashboard_album_art_stage_seconds", "Time each getAlbumArt stage takes", "stage")
+setVolume = histogram("dashboard_set_volume_seconds", "Time setting a source volume on the audio server takes")
+updateData = histogram("dashboard_update_data_seconds", "Time serializing and publishing the dashboard's playback state takes", "step")
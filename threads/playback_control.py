@@ -1,4 +1,15 @@
 from threads.dbus_thread import DBusThread
+from threads.handler_queue import HandlerQueue
+from threads.album_art_worker import AlbumArtWorker
+from threads.art_cache import AlbumArtCache
+from threads.lookup_cache import AlbumLookupCache
+from threads.connectivity import ConnectivityMonitor
+from threads.http_client import get_http_client
+from threads.art_image import pick_cover_link, download_image, make_thumbnails, MAX_DOWNLOAD_BYTES
+from threads.art_prefetcher import ArtPrefetcher
+from threads.art_matcher import best_match
+from threads.playback_state import playbackState, PlaybackState
+from threads import metrics
 import os, sys, logging
 
 import dbus
@@ -9,44 +20,42 @@ import threading
 # Useful for getting album art
 import requests
 import json
-import shutil
 
 class PlaybackControlThread(DBusThread):
-    _btObj = None # DBus bluetooth object
-    _btMgr = None # DBus object manager
+    QUEUE_POLICY = HandlerQueue.COALESCE # Only the latest player state matters, changes that pile up are merged
 
+    playerPath = None # Object path of the bluetooth media player
     playerInterface = None # DBus bluetooth media player interface
     transportPropInterface = None # DBus bluetooth media transport properties interface
 
-    playbackStatus = None
-    trackInfo = None
-
     propertyChangeExtraCallback = None # Extra function that'll be run in conjuction of normal callback, params should be `changed`
+    albumArtWorker = None # Looks up album art off the DBus thread
+    albumArtCache = None # Album art that has already been downloaded
+    albumLookupCache = None # Cover links found (or not found) by earlier lookups
+    connectivity = None # Tracks whether album art can be fetched at all
+    albumArtSizes = None # Sizes in pixels album art is shown at, the first one is the one returned
+    artPrefetcher = None # Fetches album art for upcoming tracks ahead of time
 
-    def __init__(self, logLevel, propertyChangeExtraCallback = None):
+    # albumArtCacheDir should be writable (tmpfs or a data partition), the root FS is read-only
+    def __init__(self, logLevel, propertyChangeExtraCallback = None, albumArtCacheDir = "/tmp/carDashboard/albumArt", albumArtSizes = (300,), prefetchDepth = 3):
         super().__init__("PlaybackControlThread", logLevel)
 
         # Initialize vars
-        self.btObj = self.sysBus.get_object("org.bluez", "/")
-        self.btMgr = dbus.Interface(self.btObj, "org.freedesktop.DBus.ObjectManager")
         self.propertyChangeExtraCallback = propertyChangeExtraCallback
+        self.albumArtSizes = list(albumArtSizes)
+        self.albumArtCache = AlbumArtCache(albumArtCacheDir, logger=self.logger)
+        self.albumLookupCache = AlbumLookupCache(os.path.join(albumArtCacheDir, "lookups.json"), logger=self.logger)
+        self.albumArtWorker = AlbumArtWorker(self.getAlbumArt, self.logger)
+        self.connectivity = ConnectivityMonitor(self.logger)
+        self.artPrefetcher = ArtPrefetcher(self, self.logger, prefetchDepth)
 
-        # TODO: Get playback status and track info immediately
-
-
-        # Get bluetooth player and transport interfaces
-        for path, interfaces in self.btMgr.GetManagedObjects().items():
-            if "org.bluez.MediaPlayer1" in interfaces:
-                # Get player interface
-                self.playerInterface = dbus.Interface(
-                    self.sysBus.get_object("org.bluez", path),
-                    "org.bluez.MediaPlayer1"
-                )
-            elif dbus.String("org.bluez.MediaTransport1") in interfaces:
-                self.transportPropInterface = dbus.Interface(
-                    self.sysBus.get_object("org.bluez", path),
-                    "org.freedesktop.DBus.Properties"
-                )
+        # Get bluetooth player and transport interfaces from the shared object mirror
+        for path in self.bluezObjects.find_paths("org.bluez.MediaPlayer1"):
+            # Get player interface
+            self.playerPath = path
+            self.playerInterface = self.get_interface("org.bluez", path, "org.bluez.MediaPlayer1")
+        for path in self.bluezObjects.find_paths("org.bluez.MediaTransport1"):
+            self.transportPropInterface = self.get_interface("org.bluez", path, "org.freedesktop.DBus.Properties")
         
         # Throw error if couldn't find
         if not self.playerInterface:
@@ -56,34 +65,56 @@ class PlaybackControlThread(DBusThread):
             self.logger.error(u"Unable to get the bluetooth media transport properties.")
             sys.exit(1)
 
-        # Attach reciever
-        self.sysBus.add_signal_receiver(
-            self.on_property_changed,
-            bus_name="org.bluez",
-            signal_name="PropertiesChanged",
-            dbus_interface="org.freedesktop.DBus.Properties"
-        )
+        # Get playback status and track info immediately, the mirror already has them
+        self.store_player_properties(self.bluezObjects.get_properties(self.playerPath, "org.bluez.MediaPlayer1") or {})
+
+        # Attach reciever, only for players of the connected device
+        playerDevice = self.bluezObjects.get_property(self.playerPath, "org.bluez.MediaPlayer1", "Device")
+        self.subscribe_properties(self.on_property_changed, "org.bluez.MediaPlayer1", str(playerDevice) if playerDevice else None)
 
         super().runMainLoop()
 
+    # Current playback status and track, read from the shared state store
+    @property
+    def playbackStatus(self):
+        return playbackState.get().status
+
+    @property
+    def trackInfo(self):
+        return playbackState.get().track_info()
+
     # Callback
-    def on_property_changed(self, interface, changed, invalidated):
-        if interface != "org.bluez.MediaPlayer1":
-            # Not bluetooth device, doesn't matter
-            return
-        
-        for prop, value in changed.items():
+    # Only gets MediaPlayer1 changes, the router filters out everything else
+    def on_property_changed(self, interface, changed, invalidated, path):
+        self.store_player_properties(changed)
+
+        if callable(self.propertyChangeExtraCallback):
+            self.propertyChangeExtraCallback(self, changed) # Run extra callback with info
+
+    # Puts MediaPlayer1 properties into the state store, all in one update
+    def store_player_properties(self, props):
+        changes = {}
+
+        for prop, value in props.items():
             if prop == "Status":
                 self.logger.debug(f"Playback status: {value}")
-                self.playbackStatus = value
+                changes["status"] = str(value)
+            elif prop == "Position":
+                changes["position"] = int(value)
             elif prop == "Track":
                 self.logger.debug(f"Track info: ")
                 for key in ["Title", "Artist", "Album"]:
                     self.logger.debug(f"\t{key}: {value.get(key, '')}")
-                self.trackInfo = value
+                changes.update(PlaybackState.track_changes(value))
 
-        if callable(self.propertyChangeExtraCallback):
-            self.propertyChangeExtraCallback(self, changed) # Run extra callback with info
+                # Art belongs to the old track, placeholder until the new art is found
+                changes["albumArt"] = ""
+
+                # Get art for the next few tracks ready while this one plays
+                self.artPrefetcher.track_changed(value)
+
+        if changes:
+            playbackState.update(**changes)
 
     # Playback functions, self-explanatory
     def play(self):
@@ -108,25 +139,24 @@ class PlaybackControlThread(DBusThread):
             dbus.UInt16(newVol)
         )
 
-    # Gets the album art to a song given track info, uses current track info
-    def getAlbumArt(self) -> str:
-        # Check first if user has internet connection, no point in doing all these if not
-        url = "https://www.google.com"
-        timeout = 5
+    # Looks up album art for the current track in the background, returns a future for the link
+    # callback is run with (trackInfo, link) once it's found, unless the track has changed again by then
+    def requestAlbumArt(self, callback=None):
+        return self.albumArtWorker.submit(self.trackInfo, callback)
 
-        try:
-            request = requests.get(url, timeout=timeout)
-            self.logger.debug("Internet connection found, proceeding with finding album art")
-        except (requests.ConnectionError, requests.Timeout) as exception:
-            self.logger.warn("Can't get album art due to no internet connection, returning nothing...")
-            return None
+    # Gets the album art to a song given track info, uses current track info if none is given
+    # Blocks on the network, use requestAlbumArt from callbacks
+    # maxBytes caps how much the download may use
+    def getAlbumArt(self, trackInfo=None, maxBytes=MAX_DOWNLOAD_BYTES) -> str:
+        if trackInfo is None:
+            trackInfo = self.trackInfo
 
         # Check if track info is valid and has title, artist and album before getting album art
         # If this info isn't there, then we can't get the album art
         dataValid = True
-        if type(self.trackInfo) == dbus.Dictionary:
+        if isinstance(trackInfo, dict):
             for key in ["Title", "Artist", "Album"]:
-                if self.trackInfo.get(key, "") == "":
+                if trackInfo.get(key, "") == "":
                     # Field is empty, data isn't valid
                     dataValid = False
                     break
@@ -137,51 +167,98 @@ class PlaybackControlThread(DBusThread):
         if not dataValid:
             return None
 
-        # Use Deezer API to get 1000x1000 album art, which should be high res enough
+        # Already downloaded, no need to go online
+        with metrics.albumArtStage.time("cache"):
+            cachedPath = self.albumArtCache.get_path(trackInfo["Artist"], trackInfo["Album"], self.albumArtSizes[0])
+        if cachedPath:
+            self.logger.debug("Album art found in cache")
+            return cachedPath
+
+        # Result of an earlier lookup, if nothing was found then there's no point looking again yet
+        with metrics.albumArtStage.time("lookup_cache"):
+            likelyAlbumArtLink = self.albumLookupCache.get(trackInfo["Artist"], trackInfo["Album"])
+        if likelyAlbumArtLink == "":
+            self.logger.debug("Album art is known to be unavailable, skipping lookup")
+            return None
+
+        if likelyAlbumArtLink is None:
+            with metrics.albumArtStage.time("search"):
+                likelyAlbumArtLink = self.searchAlbumArtLink(trackInfo)
+
+            if likelyAlbumArtLink is None:
+                # Lookup failed, don't remember anything so it's tried again next time
+                return None
+            elif likelyAlbumArtLink == "":
+                # Couldn't find it, remember that and return nothing
+                self.albumLookupCache.put_miss(trackInfo["Artist"], trackInfo["Album"])
+                return None
+
+            self.albumLookupCache.put_hit(trackInfo["Artist"], trackInfo["Album"], likelyAlbumArtLink)
+        
+        # Link has been fetched, we can download now, streamed and capped in size
+        try:
+            with metrics.albumArtStage.time("download"):
+                albumArtImg = download_image(get_http_client(), likelyAlbumArtLink, maxBytes)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            self.logger.warn("Lost internet connection when downloading album art: " + str(e))
+            self.connectivity.report_failure()
+            return None
+        except Exception as e:
+            # Link is broken or the image is too big, search again next time instead of trying it for a month
+            self.logger.error("Error when downloading album art: " + str(e))
+            self.albumLookupCache.forget(trackInfo["Artist"], trackInfo["Album"])
+            return None
+
+        self.connectivity.report_success()
+
+        # Shrink to the sizes it's shown at once here, instead of the front end scaling the full image on every render
+        with metrics.albumArtStage.time("thumbnails"):
+            thumbnails = make_thumbnails(albumArtImg, self.albumArtSizes)
+
+        with metrics.albumArtStage.time("store"):
+            for size in self.albumArtSizes[1:]:
+                self.albumArtCache.put(trackInfo["Artist"], trackInfo["Album"], thumbnails[size], size=size)
+
+            # Path of img in cache
+            return self.albumArtCache.put(trackInfo["Artist"], trackInfo["Album"], thumbnails[self.albumArtSizes[0]], size=self.albumArtSizes[0])
+
+    # Finds the link to an album's cover online
+    # Returns the link, "" if there's no match, or None if the lookup itself failed
+    def searchAlbumArtLink(self, trackInfo):
+        # Check first if user has internet connection, no point in doing all these if not
+        # Monitor keeps this up to date in the background, so checking doesn't block
+        if not self.connectivity.is_online():
+            self.logger.warn("Can't get album art due to no internet connection, returning nothing...")
+            return None
+
+        # Use Deezer API to get the smallest album art that's still big enough for the display
         likelyAlbumArtLink = ""
         try:
-            albumArtReq = requests.get(
-                f"http://api.deezer.com/search/album/?q={self.trackInfo['Album']}&index=0&limit=20&output=json",
-                headers={
-                    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/89.0.4389.114 Safari/537.36"
-                }
+            albumArtReq = get_http_client().get(
+                "https://api.deezer.com/search/album/",
+                params={"q": str(trackInfo["Album"]), "index": 0, "limit": 20, "output": "json"}
             )
 
             if albumArtReq.status_code == 200:
+                self.connectivity.report_success()
+
                 # Got the data, start extracting from JSON
                 parsed = json.loads(albumArtReq.content)
                 
-                # Go through all of them and check if the artist is the same
-                for album in parsed["data"]:
-                    if album["artist"]["name"] == self.trackInfo["Artist"]:
-                        likelyAlbumArtLink = album["cover_xl"]
-
-                # likelyAlbumArtLink = parsed["data"][0]["cover_xl"]
+                # Rank all of them on how well artist and album match, and take the best one
+                album = best_match(parsed["data"], trackInfo)
+                if album:
+                    likelyAlbumArtLink = pick_cover_link(album, max(self.albumArtSizes))
             else:
                 self.logger.warn("Couldn't fetch website for album art")
-                return
+                return None
 
+        except (requests.ConnectionError, requests.Timeout) as e:
+            self.logger.warn("Lost internet connection when fetching album art: " + str(e))
+            self.connectivity.report_failure()
+            return None
         except Exception as e:
             self.logger.error("Error when fetching album art: " + str(e))
-            return
-
-        if likelyAlbumArtLink == "":
-            # Couldn't find it, return nothing
             return None
-        
-        # Sanitize album name and put into normal fname template
-        fname = ''.join(e for e in self.trackInfo['Album'] if e.isalnum() or e == " ")
-        fname = fname.replace(' ', '-')
-        fname = f"albumArtImgs/{fname}.jpg"
-
-        # Check if it already exists, if it does then we don't need to download
-        if not os.path.exists(fname):
-            # Link has been fetched, we can download now
-            albumArtImg = requests.get(likelyAlbumArtLink, stream=True)
-            # Commented out because we'll be using a read-only FS
-            # with open(fname, 'wb') as f:
-            #     shutil.copyfileobj(albumArtImg.raw, f)
-            del albumArtImg
-
-        # Filename of img
-        return fname
+
+        return likelyAlbumArtLink
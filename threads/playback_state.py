@@ -0,0 +1,130 @@
+import threading
+
+# Plain Python value of a DBus one, so state never holds on to DBus types
+def plain(value, kind):
+    return kind(value) if value is not None else None
+
+# What's playing and the state of the phone, as one compact record
+# Records are never changed, every update makes a new one, so readers can hold on to one without locking
+class PlaybackState:
+    __slots__ = (
+        "version",
+        "status", "position",
+        "title", "artist", "album", "genre", "duration", "trackNumber", "numberOfTracks",
+        "albumArt",
+        "call"
+    )
+
+    # Track metadata keys as BlueZ names them, and the field each one is stored in
+    TRACK_FIELDS = {
+        "Title": ("title", str),
+        "Artist": ("artist", str),
+        "Album": ("album", str),
+        "Genre": ("genre", str),
+        "Duration": ("duration", int),
+        "TrackNumber": ("trackNumber", int),
+        "NumberOfTracks": ("numberOfTracks", int)
+    }
+
+    def __init__(self, version=0, status=None, position=None, title="", artist="", album="", genre="",
+                 duration=None, trackNumber=None, numberOfTracks=None, albumArt="", call=None):
+        setattr_ = object.__setattr__
+        setattr_(self, "version", version)
+        setattr_(self, "status", status)
+        setattr_(self, "position", position)
+        setattr_(self, "title", title)
+        setattr_(self, "artist", artist)
+        setattr_(self, "album", album)
+        setattr_(self, "genre", genre)
+        setattr_(self, "duration", duration)
+        setattr_(self, "trackNumber", trackNumber)
+        setattr_(self, "numberOfTracks", numberOfTracks)
+        setattr_(self, "albumArt", albumArt)
+        setattr_(self, "call", call)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("PlaybackState can't be changed, use replace()")
+
+    def __eq__(self, other):
+        # Version isn't part of the state, two records with the same contents are equal
+        return isinstance(other, PlaybackState) and \
+            all(getattr(self, name) == getattr(other, name) for name in self.__slots__ if name != "version")
+
+    # Copy with some fields changed
+    def replace(self, **changes):
+        fields = {name: getattr(self, name) for name in self.__slots__}
+        fields.update(changes)
+        return PlaybackState(**fields)
+
+    # Fields to update from a BlueZ Track dictionary, fields it doesn't have are cleared
+    @classmethod
+    def track_changes(cls, trackInfo):
+        changes = {}
+        for key, (name, kind) in cls.TRACK_FIELDS.items():
+            value = (trackInfo or {}).get(key)
+            changes[name] = plain(value, kind) if value is not None else ("" if kind is str else None)
+        return changes
+
+    # Track in the same shape as BlueZ's Track dictionary, only the keys that are set
+    def track_info(self):
+        track = {}
+        for key, (name, kind) in self.TRACK_FIELDS.items():
+            value = getattr(self, name)
+            if value not in (None, ""):
+                track[key] = value
+        return track
+
+    def to_dict(self):
+        return {
+            "version": self.version,
+            "status": self.status,
+            "position": self.position,
+            "track": self.track_info(),
+            "albumArtImg": self.albumArt,
+            "call": self.call
+        }
+
+# Holds the current PlaybackState for every thread and endpoint
+# Reads don't lock, they just take the current record, writers are serialized and subscribers told of every change
+class PlaybackStateStore:
+    state = None
+    lock = None
+    subscribers = None
+
+    def __init__(self):
+        self.state = PlaybackState()
+        self.lock = threading.RLock()
+        self.subscribers = []
+
+    def get(self) -> PlaybackState:
+        return self.state
+
+    # Makes a new record with the changes, returns it
+    # Subscribers are run with the new record, in order, while the lock is held, so they should be quick
+    def update(self, **changes) -> PlaybackState:
+        with self.lock:
+            newState = self.state.replace(**changes)
+            if newState == self.state:
+                return self.state
+
+            newState = newState.replace(version=self.state.version + 1)
+            self.state = newState
+
+            for subscriber in list(self.subscribers):
+                subscriber(newState)
+
+            return newState
+
+    # Runs subscriber with every new record, returns a function that unsubscribes it
+    def subscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.append(subscriber)
+        return lambda: self.unsubscribe(subscriber)
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+# Shared by every thread
+playbackState = PlaybackStateStore()
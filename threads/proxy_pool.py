@@ -0,0 +1,98 @@
+import threading
+from collections import OrderedDict
+
+import dbus
+
+from threads.dbus_runtime import DBusRuntime
+
+# Bounded, thread-safe pool of DBus interfaces keyed by (bus name, path, interface)
+# get_object can introspect the remote object, so hot paths should reuse interfaces from here
+class ProxyPool:
+    _instance = None
+    _instanceLock = threading.Lock()
+
+    MAX_SIZE = 128
+
+    bus = None
+    maxSize = MAX_SIZE
+    proxies = None # OrderedDict of {(busName, path, interface): dbus.Interface}, oldest first
+    lock = None
+    receivers = None
+
+    # Returns the pool shared by every thread, creating it on first use
+    @classmethod
+    def get_instance(cls, bus):
+        with cls._instanceLock:
+            if cls._instance is None:
+                cls._instance = cls(bus)
+            return cls._instance
+
+    def __init__(self, bus, maxSize=MAX_SIZE):
+        self.bus = bus
+        self.maxSize = maxSize
+        self.proxies = OrderedDict()
+        self.lock = threading.Lock()
+
+        # Drop proxies that can't be valid anymore
+        self.receivers = [
+            DBusRuntime.get_instance().add_signal_receiver(
+                self._interfaces_removed,
+                signal_name="InterfacesRemoved",
+                dbus_interface="org.freedesktop.DBus.ObjectManager"
+            ),
+            DBusRuntime.get_instance().add_signal_receiver(
+                self._name_owner_changed,
+                bus_name="org.freedesktop.DBus",
+                signal_name="NameOwnerChanged",
+                dbus_interface="org.freedesktop.DBus"
+            )
+        ]
+
+    def get_interface(self, busName, path, interface):
+        key = (str(busName), str(path), str(interface))
+
+        with self.lock:
+            proxy = self.proxies.get(key)
+            if proxy is not None:
+                self.proxies.move_to_end(key)
+                return proxy
+
+        # Build outside the lock, get_object may have to wait on the bus
+        proxy = dbus.Interface(self.bus.get_object(busName, path), interface)
+
+        with self.lock:
+            # Another thread may have built it in the meantime, keep the first one
+            proxy = self.proxies.setdefault(key, proxy)
+            self.proxies.move_to_end(key)
+            while len(self.proxies) > self.maxSize:
+                self.proxies.popitem(last=False)
+
+        return proxy
+
+    # Drops every proxy for an object path, and any path below it
+    def invalidate_path(self, path):
+        path = str(path)
+        with self.lock:
+            for key in [key for key in self.proxies if key[1] == path or key[1].startswith(path + "/")]:
+                del self.proxies[key]
+
+    # Drops every proxy for a bus name
+    def invalidate_bus_name(self, busName):
+        busName = str(busName)
+        with self.lock:
+            for key in [key for key in self.proxies if key[0] == busName]:
+                del self.proxies[key]
+
+    def clear(self):
+        with self.lock:
+            self.proxies.clear()
+
+    # Signal handlers
+    def _interfaces_removed(self, path, interfaces):
+        self.invalidate_path(path)
+
+    def _name_owner_changed(self, name, oldOwner, newOwner):
+        # Proxies are bound to the owner they were created with, so they go stale when it changes
+        if oldOwner:
+            self.invalidate_bus_name(name)
+            self.invalidate_bus_name(oldOwner)
@@ -0,0 +1,94 @@
+import threading
+
+# A handler registered with a SignalRouter, remove() unsubscribes it like a dbus-python match
+class RouterSubscription:
+    def __init__(self, router, entry):
+        self.router = router
+        self.entry = entry
+
+    def remove(self):
+        self.router.unsubscribe(self.entry)
+
+# Fans one bus subscription to a signal out to many handlers
+# Handlers are keyed by the signal's first argument (the interface, for PropertiesChanged), and can be limited to a path namespace
+# The daemon is only asked for the arg0 values someone handles, unless a handler wants every one, then a single catch-all is used
+# Either way each signal is unmarshalled once, instead of once for every receiver that matches it
+class SignalRouter:
+    runtime = None
+    match = None # Match the bus subscriptions are made with (bus_name, signal_name, dbus_interface, ...)
+    handlers = None # {arg0 or None: [(path namespace, handler, name)]}, None gets every signal
+    receivers = None # {arg0 or None: bus match}
+    lock = None
+
+    delivered = 0 # Signals the bus delivered to the router
+    dispatched = 0 # Handler calls made from them
+
+    def __init__(self, runtime, **match):
+        self.runtime = runtime
+        self.match = match
+        self.handlers = {}
+        self.receivers = {}
+        self.lock = threading.Lock()
+
+    # Handler is called with the signal's arguments and the object path as the last one
+    # arg0 limits it to signals with that first argument, pathNamespace to objects at or below that path
+    def subscribe(self, handler, arg0=None, pathNamespace=None, name=None) -> RouterSubscription:
+        name = name or getattr(handler, "__qualname__", repr(handler))
+        entry = (str(pathNamespace).rstrip("/") if pathNamespace else None, self.runtime.timed(handler, name), name)
+
+        with self.lock:
+            self.handlers.setdefault(arg0, []).append(entry)
+            self.update_receivers()
+
+        return RouterSubscription(self, entry)
+
+    def unsubscribe(self, entry):
+        with self.lock:
+            for key, entries in list(self.handlers.items()):
+                if entry in entries:
+                    entries.remove(entry)
+                if not entries:
+                    del self.handlers[key]
+            self.update_receivers()
+
+    # Makes the bus subscriptions match the handlers, should be called with the lock held
+    def update_receivers(self):
+        wanted = {None} if None in self.handlers else set(self.handlers)
+
+        # Add before removing, a signal handled twice while switching is better than one missed
+        for key in wanted - set(self.receivers):
+            match = dict(self.match)
+            if key is not None:
+                match["arg0"] = key
+            self.receivers[key] = self.runtime.bus.add_signal_receiver(self.dispatch, path_keyword="path", **match)
+
+        for key in set(self.receivers) - wanted:
+            self.receivers.pop(key).remove()
+
+    def dispatch(self, *args, path=None):
+        path = str(path)
+        key = str(args[0]) if args else None
+
+        # Copy under the lock so handlers can unsubscribe while being run
+        with self.lock:
+            self.delivered += 1
+            entries = self.handlers.get(None, []) + (self.handlers.get(key, []) if key is not None else [])
+
+        for pathNamespace, handler, name in entries:
+            if pathNamespace and path != pathNamespace and not path.startswith(pathNamespace + "/"):
+                continue
+
+            self.dispatched += 1
+            try:
+                handler(*args, path)
+            except Exception:
+                self.runtime.logger.exception(f"Signal handler {name} failed")
+
+    def stats(self):
+        with self.lock:
+            return {
+                "delivered": self.delivered,
+                "dispatched": self.dispatched,
+                "subscriptions": sorted(str(key) for key in self.receivers),
+                "handlers": sum(len(entries) for entries in self.handlers.values())
+            }
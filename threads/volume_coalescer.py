@@ -0,0 +1,82 @@
+import threading, time
+
+# Sits between volume signals and the audio backend
+# Only the latest volume per device is kept, and it's applied at most maxRate times a second on a worker thread
+# The last value submitted is always applied, the ones in between are dropped
+class VolumeCoalescer:
+    applyFunc = None # Run with (address, volume) on the worker thread
+    logger = None
+    minInterval = 0
+
+    pending = None # {address: latest volume not applied yet}
+    condition = None
+    workerThread = None
+    running = False
+    lastApplied = 0
+
+    # Counters, see stats()
+    received = 0
+    applied = 0
+    dropped = 0
+
+    def __init__(self, applyFunc, logger, maxRate=20):
+        self.applyFunc = applyFunc
+        self.logger = logger
+        self.minInterval = 1 / maxRate if maxRate else 0
+        self.pending = {}
+        self.condition = threading.Condition()
+
+        self.running = True
+        self.workerThread = threading.Thread(target=self.run)
+        self.workerThread.daemon = True
+        self.workerThread.start()
+
+    # Called from the signal handler, never blocks on the backend
+    def submit(self, address, volume):
+        with self.condition:
+            self.received += 1
+            if address in self.pending:
+                # Older value was never applied, it's replaced by this one
+                self.dropped += 1
+            self.pending[address] = volume
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.pending:
+                    self.condition.wait()
+                if not self.running:
+                    return
+
+                # Wait out the rest of the interval, newer values can still come in meanwhile
+                delay = self.lastApplied + self.minInterval - time.monotonic()
+                if delay > 0:
+                    self.condition.wait(delay)
+                    continue
+
+                address, volume = self.pending.popitem()
+                self.lastApplied = time.monotonic()
+
+            # Apply outside the lock so submit() isn't held up by the backend
+            try:
+                self.applyFunc(address, volume)
+            except Exception as e:
+                self.logger.error(u"Error when applying volume {} to {}: {}".format(volume, address, e))
+
+            with self.condition:
+                self.applied += 1
+
+    def stats(self):
+        with self.condition:
+            return {
+                "received": self.received,
+                "applied": self.applied,
+                "dropped": self.dropped,
+                "pending": len(self.pending)
+            }
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
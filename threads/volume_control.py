@@ -1,77 +1,136 @@
 from threads.dbus_thread import DBusThread
-import os, sys, logging
-import dbus
+from threads.handler_queue import HandlerQueue
+from threads.audio_backend import create_backend
+from threads.volume_coalescer import VolumeCoalescer
+from threads import metrics
+import sys, logging
 import threading
 
 # Transports volume control on phone to actual volume on pi, none of the functions here should actually be run
 class VolumeControlThread(DBusThread):
     VOLUME_MAX = 127
+    QUEUE_POLICY = HandlerQueue.COALESCE # Transport changes that pile up are merged, the newest volume wins anyway
     currentVol = 0
 
-    def __init__(self, logLevel):
+    transports = None # Device name, address and codec of each media transport, keyed by transport path
+    audioBackend = None # Sets source volumes on the audio server
+    volumeCoalescer = None # Rate limits volume changes, keeping only the latest
+
+    # maxVolumeRate is the most volume changes applied per second, bursts in between are coalesced
+    def __init__(self, logLevel, maxVolumeRate=20):
         super().__init__("VolumeControlThread", logLevel) # Initializes DBus stuff
-        
-        # Add listeners to org.bluez
-        self.sysBus.add_signal_receiver(
-            self.device_property_changed,
+
+        # Keep one connection to the audio server instead of spawning pactl for every change
+        self.audioBackend = create_backend(self.logger)
+        self.volumeCoalescer = VolumeCoalescer(self.setVolume, self.logger, maxVolumeRate)
+        metrics.collector(
+            "dashboard_volume_updates_total",
+            "Volume updates received from the phone, applied to the audio server, and dropped for a newer one",
+            "counter",
+            lambda: {stage: count for stage, count in self.volumeStats().items() if stage != "pending"},
+            "stage"
+        )
+        metrics.collector(
+            "dashboard_volume_updates_pending",
+            "Volume updates waiting to be applied",
+            "gauge",
+            lambda: self.volumeStats()["pending"]
+        )
+
+        # Fill transport info for transports that already exist, and keep it updated as they come and go
+        self.transports = {}
+        for path, props in self.bluezObjects.find_objects('org.bluez.MediaTransport1').items():
+            self.add_transport(path, props)
+
+        self.add_signal_receiver(
+            self.interfaces_added,
+            bus_name='org.bluez',
+            signal_name='InterfacesAdded',
+            dbus_interface='org.freedesktop.DBus.ObjectManager'
+        )
+        self.add_signal_receiver(
+            self.interfaces_removed,
             bus_name='org.bluez',
-            signal_name='PropertiesChanged',
-            dbus_interface='org.freedesktop.DBus.Properties',
-            path_keyword='path'
+            signal_name='InterfacesRemoved',
+            dbus_interface='org.freedesktop.DBus.ObjectManager'
         )
+        
+        # Only transport changes are delivered, the router drops the rest before they get here
+        self.subscribe_properties(self.device_property_changed, 'org.bluez.MediaTransport1')
 
         # Start mainloop
         super().runMainLoop()
 
     # Given a bluetooth address in format AA:BB:CC:DD:EE:FF, fetch the index number to the pulseaudio source
     def addressToIndex(self, address: str) -> int:
-        paSrc = os.popen('pactl list short sources | grep bluez_source.{}'.format(address.replace(':', '_'))).read()
-
-        if not paSrc:
-             self.logger.debug(u"Cannot find PulseAudio A2DP source {}".format(address))
-             return
-            
-        # Source index is first field in tab separated string
-        paIdx = paSrc.split("\t")[0]
-        self.logger.debug(u"PulseAudio A2DP source {} is #{}".format(address, paIdx))
-        return paIdx
-
-    # Sets volume of pulseaudio source
+        return self.audioBackend.address_to_index(address)
+
+    # Sets volume of pulseaudio source, run on the coalescer's worker thread
+    @metrics.timed(metrics.setVolume)
     def setVolume(self, address, volume):
-        paIdx = self.addressToIndex(address)
-        if paIdx:
-            self.logger.debug(u'Running pactl set-source-volume {} {}'.format(paIdx, format(float(volume) / self.VOLUME_MAX, '.2f')))
-            os.system('pactl set-source-volume {} {}'.format(paIdx, format(float(volume) / self.VOLUME_MAX, '.2f')))
-            self.currentVol = float(volume) / self.VOLUME_MAX
+        newVol = float(volume) / self.VOLUME_MAX
+        if self.audioBackend.set_source_volume(address, newVol):
+            self.logger.debug(u'Set volume of {} to {}'.format(address, format(newVol, '.2f')))
+            self.currentVol = newVol
         else:
             self.logger.debug(u'Skipping volume change')
     
+    # Caches everything about a transport that doesn't change per signal, only done once per transport
+    def add_transport(self, path, props):
+        device_path = props.get('Device')
+        device = self.bluezObjects.get_properties(device_path, 'org.bluez.Device1') if device_path else None
+
+        # Mirror doesn't know the device, ask BlueZ this one time
+        if device is None and device_path:
+            device = self.get_interface('org.bluez', device_path, 'org.freedesktop.DBus.Properties').GetAll('org.bluez.Device1')
+
+        self.transports[str(path)] = {
+            "name": str((device or {}).get('Name', '')),
+            "address": str((device or {}).get('Address', '')),
+            "codec": int(props.get('Codec', 0))
+        }
+        return self.transports[str(path)]
+
+    def interfaces_added(self, path, interfaces):
+        if 'org.bluez.MediaTransport1' in interfaces:
+            self.add_transport(path, interfaces['org.bluez.MediaTransport1'])
+
+    def interfaces_removed(self, path, interfaces):
+        if 'org.bluez.MediaTransport1' in interfaces:
+            self.transports.pop(str(path), None)
+
     # Callback for when property changes
-    # TODO: Add comments
+    # Only uses cached transport info, so a volume change doesn't make any bus calls
     def device_property_changed(self, interface, properties, invalidated, path):
-        if interface == 'org.bluez.MediaTransport1':
-            self.sysBus = dbus.SystemBus()
-            mediatransport_object = self.sysBus.get_object('org.bluez', path)
-            mediatransport_properties_interface = dbus.Interface(mediatransport_object, 'org.freedesktop.DBus.Properties')
-            device_path = mediatransport_properties_interface.Get('org.bluez.MediaTransport1', 'Device')
-            device_object = self.sysBus.get_object('org.bluez', device_path)
-            device_properties_interface = dbus.Interface(device_object, 'org.freedesktop.DBus.Properties')
-            name = device_properties_interface.Get('org.bluez.Device1', 'Name')
-            address = device_properties_interface.Get('org.bluez.Device1', 'Address')
-            if 'State' in properties:
-                state = properties['State']
-                self.logger.info(u'Bluetooth A2DP source: {} ({}) is now {}'.format(name, address, state))
-                if state == 'active':
-                    codec =  mediatransport_properties_interface.Get('org.bluez.MediaTransport1', 'Codec')
-                    self.logger.debug(u'Bluetooth A2DP source: {} ({}) codec is {}'.format(name, address, int(codec)))
-                    volume = mediatransport_properties_interface.Get('org.bluez.MediaTransport1', 'Volume')
-                    self.logger.debug(u'Bluetooth A2DP source: {} ({}) volume is {}'.format(name, address, volume))
-                    self.setVolume(address, volume)
-            elif 'Volume' in properties:
-                volume = properties['Volume']
-                self.logger.debug(u'Bluetooth A2DP source: {} ({}) volume is now {}'.format(name, address, volume))
-                self.setVolume(address, volume)
-            elif 'Codec' in properties:
-                codec = properties['Codec']
-                self.logger.debug(u'Bluetooth A2DP source: {} ({}) codec is {}'.format(name, address, int(codec)))
+        if interface != 'org.bluez.MediaTransport1':
+            return
+
+        transport = self.transports.get(str(path))
+        if transport is None:
+            # Transport appeared before we started listening, fill it in now
+            transport = self.add_transport(path, self.bluezObjects.get_properties(path, interface) or {})
+        name = transport["name"]
+        address = transport["address"]
+
+        # Changes queued behind a slow call are merged, so one call can carry any mix of Codec, State and Volume
+        if 'Codec' in properties:
+            transport["codec"] = int(properties['Codec'])
+
+        volume = properties.get('Volume')
+        if 'State' in properties:
+            state = properties['State']
+            self.logger.info(u'Bluetooth A2DP source: {} ({}) is now {}'.format(name, address, state))
+            if state == 'active' and volume is None:
+                # Volume isn't always sent when playback starts, use the one the mirror last saw
+                volume = self.bluezObjects.get_property(path, interface, 'Volume')
+
+        if 'Codec' in properties or properties.get('State') == 'active':
+            self.logger.debug(u'Bluetooth A2DP source: {} ({}) codec is {}'.format(name, address, transport["codec"]))
+
+        if volume is not None:
+            self.logger.debug(u'Bluetooth A2DP source: {} ({}) volume is now {}'.format(name, address, volume))
+            self.volumeCoalescer.submit(address, volume)
 
+    # Received, applied and dropped volume update counts
+    def volumeStats(self):
+        return self.volumeCoalescer.stats()
@@ -1,34 +1,187 @@
 # This technically does not use DBus, but is still very useful
 from threads.dbus_thread import DBusThread
-import os, sys, logging
-from flask import Flask
+import os, sys, logging, hashlib, threading, re, base64
+from collections import namedtuple
+from flask import Flask, Response, request, send_file, abort
 from json import dumps
 
-playbackData = {}
+from threads.event_stream import EventBroker
+from threads.playback_state import playbackState
+from threads import metrics
+
+# Production WSGI server is optional, falls back to werkzeug's threaded server
+try:
+    import waitress
+except ImportError:
+    waitress = None
+from werkzeug.serving import make_server
+
+# Immutable, already serialized copy of the playback state, so requests never serialize anything
+PlaybackSnapshot = namedtuple("PlaybackSnapshot", ["version", "etag", "body"])
+
+playbackSnapshot = PlaybackSnapshot(0, '"empty"', b"{}") # Replaced as a whole, never changed in place
+playbackEvents = EventBroker() # Pushes the playback state to /events clients whenever it changes
+
+PLACEHOLDER_IMG = "/home/pi/carDashboard/albumArtImgs/placeholder.png"
+
+# Album art URLs contain the image's hash, so they never change and can be cached forever
+ART_CACHE_CONTROL = "public, max-age=31536000, immutable"
+ART_NAME_RE = re.compile(r"^([0-9a-f]{64})\.(jpg|png)$")
+
+albumArtCache = None # AlbumArtCache that /art serves from, set with set_art_cache()
+
+# Placeholder is kept in memory, a plain grey pixel is used if the file isn't there
+def load_placeholder():
+    try:
+        with open(PLACEHOLDER_IMG, "rb") as f:
+            return f.read()
+    except OSError:
+        return base64.b64decode("iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAIAAACQd1PeAAAADElEQVR4nGNwcHAAAAGEAMGDX2mUAAAAAElFTkSuQmCC")
+
+placeholderBytes = load_placeholder()
+placeholderHash = hashlib.sha256(placeholderBytes).hexdigest()
+PLACEHOLDER_URL = f"/art/{placeholderHash}.png"
+
+# Images held in memory, answering revalidation with 304 the same way send_file does for files
+def memory_art_response(data, digest, mimetype):
+    headers = {"ETag": f'"{digest}"', "Cache-Control": ART_CACHE_CONTROL}
+    if digest in request.headers.get("If-None-Match", ""):
+        return Response(status=304, headers=headers)
+    return Response(data, mimetype=mimetype, headers=headers)
 
 class WebServerThread(DBusThread):
     flaskApp = Flask(__name__)
 
+    server = None # WSGI server started by start()
+    serverThread = None
+
     def __init__(self, logLevel):
         super().__init__("WebServerThread", logLevel) # Initializes DBus and logging
 
+        # Serialize the state once per change, whoever changed it
+        playbackState.subscribe(self.publish_snapshot)
+        self.publish_snapshot(playbackState.get())
+
         # Start main loop
         super().runMainLoop()
         
-    def run(self):
-        self.flaskApp.run(debug=False, use_reloader=False, host="0.0.0.0")
+    # Serves the app on its own thread so the caller can carry on, stop with stop()
+    # Uses waitress with `workers` threads if it's installed, otherwise werkzeug's threaded server (a thread per request)
+    # Every open /events stream holds a waitress thread, so workers should cover the clients expected plus a few
+    def start(self, host="0.0.0.0", port=5000, workers=8):
+        if waitress is not None:
+            self.server = waitress.create_server(self.flaskApp, host=host, port=port, threads=workers)
+            serve = self.server.run
+            self.logger.info(f"Serving on {host}:{port} with waitress ({workers} threads)")
+        else:
+            self.server = make_server(host, port, self.flaskApp, threaded=True)
+            serve = self.server.serve_forever
+            self.logger.info(f"Serving on {host}:{port} with werkzeug")
 
-    def update_data(self, trackInfo, playbackStatus, albumArtImgLink):
-        playbackData["status"] = playbackStatus
-        playbackData["track"] = trackInfo
-        
-        if albumArtImgLink != "":
-            playbackData["albumArtImg"] = albumArtImgLink
+        self.serverThread = threading.Thread(target=serve, name="WebServer")
+        self.serverThread.daemon = True
+        self.serverThread.start()
+
+    # Ends /events streams and stops accepting requests, waits up to `timeout` seconds for the server to finish
+    def stop(self, timeout=5):
+        if self.server is None:
+            return
+
+        playbackEvents.close()
+        if waitress is not None:
+            self.server.close()
         else:
-            playbackData["albumArtImg"] = "/home/pi/carDashboard/albumArtImgs/placeholder.png"
+            self.server.shutdown()
+        self.serverThread.join(timeout)
+        self.server = None
+        self.logger.info("Web server stopped")
 
+    # Lets /art serve images from the album art cache
+    def set_art_cache(self, artCache):
+        global albumArtCache
+        albumArtCache = artCache
+
+    # URL the front end can fetch an image in the album art cache from
+    @staticmethod
+    def art_url(albumArtImgLink):
+        name = os.path.basename(albumArtImgLink)
+        if ART_NAME_RE.match(name):
+            return f"/art/{name}"
+        return albumArtImgLink
+
+    # Shows album art for the current track, an empty string or None shows the placeholder
+    def set_album_art(self, albumArtImgLink):
+        playbackState.update(albumArt=self.art_url(albumArtImgLink) if albumArtImgLink else "")
+
+    # Serializes a state once, for / and /events to share, run by the state store on every change
+    @metrics.timed(metrics.updateData, "publish_snapshot")
+    def publish_snapshot(self, state):
+        global playbackSnapshot
+
+        data = state.to_dict()
+        data["albumArtImg"] = state.albumArt or PLACEHOLDER_URL
+        body = dumps(data, sort_keys=True).encode()
+
+        etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+        playbackSnapshot = PlaybackSnapshot(state.version, etag, body)
+        playbackEvents.publish(body.decode(), eventId=state.version)
+
+    # Clients polling with If-None-Match get a 304 until something changes
     @flaskApp.route("/")
     def indexPage():
-        return dumps(playbackData)
+        snapshot = playbackSnapshot
+        headers = {"ETag": snapshot.etag, "Cache-Control": "no-cache"}
+
+        if snapshot.etag in request.headers.get("If-None-Match", ""):
+            return Response(status=304, headers=headers)
+
+        return Response(snapshot.body, mimetype="application/json", headers=headers)
+
+    # Latency histograms in Prometheus' text format, only there when metrics are turned on
+    @flaskApp.route("/metrics")
+    def metricsPage():
+        if not metrics.enabled:
+            abort(404)
+        return Response(metrics.render(), mimetype="text/plain; version=0.0.4", headers={"Cache-Control": "no-cache"})
+
+    # Server-Sent Events stream of the playback state, sent again every time it changes
+    # Clients that reconnect with Last-Event-ID get the updates they missed
+    @flaskApp.route("/events")
+    def eventsPage():
+        lastEventId = request.headers.get("Last-Event-ID", request.args.get("lastEventId"))
+        return Response(
+            playbackEvents.stream(lastEventId),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
+    # Album art by content hash, e.g. /art/<sha256>.jpg
+    # Files are streamed in chunks by send_file (neither waitress nor werkzeug uses sendfile), browsers revalidate with the hash as ETag
+    @flaskApp.route("/art/<name>")
+    def artPage(name):
+        match = ART_NAME_RE.match(name)
+        if not match:
+            abort(404)
+        digest, ext = match.groups()
+        mimetype = "image/jpeg" if ext == "jpg" else "image/png"
+
+        if digest == placeholderHash:
+            return memory_art_response(placeholderBytes, digest, "image/png")
+
+        if albumArtCache is None:
+            abort(404)
+
+        # Cache couldn't write to disk, so the image is only in memory
+        if not albumArtCache.writable:
+            data = albumArtCache.get_bytes(digest)
+            if data is None:
+                abort(404)
+            return memory_art_response(data, digest, mimetype)
 
+        path = albumArtCache.file_path(digest, ext)
+        if not os.path.exists(path):
+            abort(404)
 
+        response = send_file(path, mimetype=mimetype, etag=digest, conditional=True)
+        response.headers["Cache-Control"] = ART_CACHE_CONTROL
+        return response